@@ -1,116 +1,168 @@
-import wget
+from concurrent.futures import ThreadPoolExecutor
 import json
 import threading
 import os
 import sys
 import argparse
+from export_store import ExportStore
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from pl_client import PrairieLearnClient, PrairieLearnError, atomicWrite
 
 course_instance = ""
 access_token = ""
 root_path = ""
 folder = ""
+pl_server = ""
+thread_num = 0
+client = None
+store = None
+sync = False
+sync_counts = {"new": 0, "changed": 0, "unchanged": 0}
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--course_instance", help="course instance number")
 parser.add_argument("--access_token", help="api access token")
 parser.add_argument("--root_path", help="root path where you hope to store the data")
 parser.add_argument("--folder", help="newly created folder name for downloaded data")
-
-def downloadFile(url, path):
-    if os.path.isfile(path):
-        return
+parser.add_argument("--pl_server", help="PrairieLearn server url", default="https://prairielearn.engr.illinois.edu")
+parser.add_argument("--thread_num", help="max number of files downloading at once", type=int, default=16)
+parser.add_argument("--max_retries", help="retries of a file on 429, 5xx, timeout or connection error", type=int, default=5)
+parser.add_argument("--timeout", help="seconds to wait for server before a request is retried", type=float, default=60)
+parser.add_argument("--rate_limit", help="max requests per second to PrairieLearn, 0 for no limit", type=float, default=0)
+parser.add_argument("--sync", help="refresh an existing export, refetch only instances that are new, open or changed since last run", action="store_true")
+parser.add_argument("--sqlite_path", help="write the export into this sqlite file instead of json files under root_path/folder", default="")
+
+# @return response body, None if it failed
+def fetch(url):
     try:
-        base_url = f"https://prairielearn.engr.illinois.edu/pl/api/v1/course_instances/{course_instance}"
-        permission = "?private_token=" + access_token
-        wget.download(base_url + url + permission, path)
-    except:
-        return
+        return client.getBytes(url)
+    except PrairieLearnError as e:
+        print(e, file = sys.stderr)
+        return None
+
+# save url to path, or to kind rows of key in sqlite store if one is open
+# @param force, fetch again and replace what is in the export
+# @return True if it is in the export
+def downloadFile(url, path, kind = None, key = None, force = False):
+    if store is not None:
+        if not force and store.has(url):
+            return True
+        body = fetch(url)
+        if body is None:
+            return False
+        store.put(kind, key, url, body)
+        return True
+    if not force and os.path.isfile(path):
+        return True
+    body = fetch(url)
+    if body is None:
+        return False
+    # an existing file is always complete
+    atomicWrite(path, body)
+    return True
+
 
 def get_assessment_list():
-    assessment_url = "/assessments"
-    downloadFile(assessment_url, f"{root_path}/{folder}/assessments.json")
+    assessment_url = client.assessmentsPath()
+    downloadFile(assessment_url, f"{root_path}/{folder}/assessments.json", "assessments", force = sync)
 
 def get_gradebook():
-    gradebook_url = "/pl/api/v1/course_instances/"  +course_instance + "/gradebook"
-    downloadFile(gradebook_url, f"{root_path}/{folder}/gradebook.json")
-
-def get_assessment_instance():
-    #read assessments list from json file
-    assessment_file = open(f'{root_path}/{folder}/assessments.json')
-    assessment_list = json.loads(assessment_file.read())
-    tid = []
-    #setup progress bar 
-    for i in range(len(assessment_list)):
-        asessment_instance = assessment_list[i]   
-        id = str(asessment_instance["assessment_id"])
-        asessment_instance_url = "/assessments/" + id + "/assessment_instances"
-        thread = threading.Thread(target=downloadFile, args=[asessment_instance_url, f"{root_path}/{folder}/Assessment_instances/asessment_" + id + "_instances.json"])
-        tid.append(thread)
-        thread.start()
-    for i in tid:
-        i.join()
-
-def get_assessment_instance_list():
-    #read assessments list from json file
-    assessment_file = open(f"{root_path}/{folder}/assessments.json")
-    assessment_list = json.loads(assessment_file.read())
-
-    assessment_instance_list = []
-    #setup progress bar 
-    for i in range(len(assessment_list)):
-        
-        # get current assessment id
-        asessment_instance = assessment_list[i] 
-        id = str(asessment_instance["assessment_id"])
-        
-        # open aseessment file
-        assessment_instance_file = open(f"{root_path}/{folder}/Assessment_instances/asessment_" + id + "_instances.json")
-        temp_list = json.loads(assessment_instance_file.read())
-
-        # add all asessment instance id to list
-        for j in temp_list:
-            instance_id = j['assessment_instance_id']
-            if instance_id not in assessment_instance_list:
-                assessment_instance_list.append(instance_id)
-    
-    return assessment_instance_list
-
-def get_instance_questions(assessment_instance_list):
-    #get quesitons
-    tid = []
-    for i in range(len(assessment_instance_list)):
-        id = str(assessment_instance_list[i])
-        instance_questions_url = "/assessment_instances/" + id + "/instance_questions"
-        thread= threading.Thread(target=downloadFile, args=[instance_questions_url, f"{root_path}/{folder}/Instance_questions/assessment_instance_" + id + "_instance_questions.json"])
-        tid.append(thread)
-        thread.start()
-    for i in tid:
-        i.join()
-
-def get_instance_submission(assessment_instance_list):
-    #get submissions
-    tid = []
-    for i in range(len(assessment_instance_list)):
-        id = str(assessment_instance_list[i])
-        submissions_url = "/assessment_instances/" + id + "/submissions"
-        tread = threading.Thread(target=downloadFile, args=[submissions_url, f"{root_path}/{folder}/Submissions/assessment_instance_" + id + "_submissions.json"])
-        tid.append(thread)
-        tread.start()
-    for i in tid:
-        i.join()
-    
-
-def get_instance_log(assessment_instance_list):
-    #get logs
-    tid = []
-    for i in range(len(assessment_instance_list)):
-        id = str(assessment_instance_list[i])
-        log_url = "/assessment_instances/" + id + "/log"
-        tread = threading.Thread(target=downloadFile, args=[log_url, f"{root_path}/{folder}/Log/assessment_instance_" + id + "_log.json"])
-        tid.append(thread)
-        tread.start()
-    for i in tid:
-        i.join()
+    gradebook_url = client.gradebookPath()
+    downloadFile(gradebook_url, f"{root_path}/{folder}/gradebook.json", "gradebook", force = sync)
+
+"""
+Runs download jobs on thread_num workers. A job may schedule more jobs, join()
+returns once every job, including those scheduled later, has finished.
+"""
+class Scheduler:
+    def __init__(self, workers):
+        self.pool = ThreadPoolExecutor(max_workers = workers)
+        self.cond = threading.Condition()
+        self.pending = 0
+
+    def submit(self, fn, *args):
+        with self.cond:
+            self.pending += 1
+        self.pool.submit(self.run, fn, args)
+
+    def run(self, fn, args):
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"{fn.__name__}{args}: {e}", file = sys.stderr)
+        finally:
+            with self.cond:
+                self.pending -= 1
+                self.cond.notify_all()
+
+    def join(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.pending == 0)
+        self.pool.shutdown()
+
+# instance list entries of an assessment currently in the export, instance id -> entry
+def instance_snapshot(assessment_id, path):
+    if store is not None:
+        return store.instanceSnapshot(assessment_id)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return {j['assessment_instance_id']: j for j in json.load(f)}
+
+def get_assessment_instance(scheduler, assessment_id, seen, seen_lock):
+    id = str(assessment_id)
+    asessment_instance_url = client.assessmentInstancesPath(id)
+    path = f"{root_path}/{folder}/Assessment_instances/asessment_" + id + "_instances.json"
+    # with --sync the list is fetched again and compared with the one from last run
+    previous = instance_snapshot(assessment_id, path) if sync else {}
+    if not downloadFile(asessment_instance_url, path, "assessment_instances", assessment_id, force = sync):
+        return
+    current = instance_snapshot(assessment_id, path)
+    # fan out as soon as this assessment is known, an instance is fetched once even if listed twice
+    for instance_id, entry in current.items():
+        with seen_lock:
+            if instance_id in seen:
+                continue
+            seen.add(instance_id)
+        refresh = False
+        if sync:
+            # an open instance can still get submissions, anything else changes its list entry too
+            if instance_id not in previous:
+                change = "new"
+            elif entry.get("open") or json.dumps(entry, sort_keys = True) != json.dumps(previous[instance_id], sort_keys = True):
+                change = "changed"
+            else:
+                change = "unchanged"
+            refresh = change != "unchanged"
+            with seen_lock:
+                sync_counts[change] += 1
+        get_instance_files(scheduler, instance_id, refresh)
+
+def get_instance_files(scheduler, instance_id, force = False):
+    id = str(instance_id)
+    scheduler.submit(downloadFile, client.instanceQuestionsPath(id), f"{root_path}/{folder}/Instance_questions/assessment_instance_" + id + "_instance_questions.json", "instance_questions", instance_id, force)
+    scheduler.submit(downloadFile, client.submissionsPath(id), f"{root_path}/{folder}/Submissions/assessment_instance_" + id + "_submissions.json", "submissions", instance_id, force)
+    scheduler.submit(downloadFile, client.logPath(id), f"{root_path}/{folder}/Log/assessment_instance_" + id + "_log.json", "log", instance_id, force)
+
+"""
+Download the whole course instance. Every assessment's instance list is fetched at
+once and its instances' questions, submissions and logs are queued the moment it
+arrives, so there is a single join at the end instead of one per phase.
+"""
+def export_course():
+    scheduler = Scheduler(thread_num)
+    seen = set(); seen_lock = threading.Lock()
+    scheduler.submit(get_gradebook)
+    get_assessment_list()
+    if store is not None:
+        assessment_ids = store.assessmentIds()
+    else:
+        with open(f"{root_path}/{folder}/assessments.json") as f:
+            assessment_ids = [asessment["assessment_id"] for asessment in json.load(f)]
+    for assessment_id in assessment_ids:
+        scheduler.submit(get_assessment_instance, scheduler, assessment_id, seen, seen_lock)
+    scheduler.join()
+    return len(seen)
 
 def init():
     if not os.path.exists(f"{root_path}/{folder}"):
@@ -135,13 +187,21 @@ if __name__ == "__main__":
     access_token = args.access_token
     root_path = args.root_path
     folder = args.folder
-    init()
-    get_assessment_list()
-    get_gradebook()
-    get_assessment_instance()
-    assessment_instance_list = get_assessment_instance_list()
-    get_instance_questions(assessment_instance_list)
-    get_instance_submission(assessment_instance_list)
-    get_instance_log(assessment_instance_list)
-
-
+    pl_server = args.pl_server.rstrip("/")
+    thread_num = args.thread_num
+    sync = args.sync
+    client = PrairieLearnClient(pl_server, course_instance, access_token, pool_size = thread_num,
+                                timeout = args.timeout, max_retries = args.max_retries, rate_limit = args.rate_limit)
+    if args.sqlite_path:
+        try:
+            store = ExportStore(args.sqlite_path, course_instance)
+        except ValueError as e:
+            print(e, file = sys.stderr)
+            sys.exit(1)
+    else:
+        init()
+    export_course()
+    if sync:
+        print(f"sync: {sync_counts['new']} new, {sync_counts['changed']} changed, {sync_counts['unchanged']} unchanged assessment instances")
+    if store is not None:
+        store.close()
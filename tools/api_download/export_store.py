@@ -0,0 +1,135 @@
+import json
+import sqlite3
+import threading
+import time
+
+"""
+Single file sqlite store of a course instance export.
+Each api response is parsed once and written as rows keyed by assessment_id,
+assessment_instance_id and submission_id, together with a marker of its url,
+in one transaction. A url is therefore either fully stored or refetched, and
+analyses can join tables instead of walking directories of json files.
+Every row keeps the original api object as json in its data column.
+A store holds a single course instance, opening it for another one raises ValueError.
+"""
+class ExportStore:
+    """
+    @param path, sqlite database file
+    @param course_instance, course instance id the store is for
+    """
+    def __init__(self, path, course_instance):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread = False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS store_info (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS fetched (
+                url TEXT PRIMARY KEY,
+                fetched_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS assessment (
+                assessment_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS gradebook (
+                user_uid TEXT PRIMARY KEY,
+                data TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS assessment_instance (
+                assessment_instance_id INTEGER PRIMARY KEY,
+                assessment_id INTEGER NOT NULL,
+                data TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS assessment_instance_assessment ON assessment_instance (assessment_id);
+            CREATE TABLE IF NOT EXISTS instance_question (
+                instance_question_id INTEGER PRIMARY KEY,
+                assessment_instance_id INTEGER NOT NULL,
+                data TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS instance_question_instance ON instance_question (assessment_instance_id);
+            CREATE TABLE IF NOT EXISTS submission (
+                submission_id INTEGER PRIMARY KEY,
+                assessment_instance_id INTEGER NOT NULL,
+                data TEXT NOT NULL);
+            CREATE INDEX IF NOT EXISTS submission_instance ON submission (assessment_instance_id);
+            CREATE TABLE IF NOT EXISTS log_event (
+                assessment_instance_id INTEGER NOT NULL,
+                seq INTEGER NOT NULL,
+                event_date TEXT,
+                event_name TEXT,
+                submission_id INTEGER,
+                data TEXT NOT NULL,
+                PRIMARY KEY (assessment_instance_id, seq));
+            CREATE INDEX IF NOT EXISTS log_event_submission ON log_event (submission_id);""")
+        self.conn.commit()
+        self.checkCourseInstance(str(course_instance))
+
+    """
+    Record the course instance of a new store, refuse a store of another course instance.
+    Fetched markers are api paths under the course instance, they would skip every path of another one.
+    """
+    def checkCourseInstance(self, course_instance):
+        row = self.conn.execute("SELECT value FROM store_info WHERE key = 'course_instance'").fetchone()
+        if row is None:
+            if self.conn.execute("SELECT 1 FROM fetched LIMIT 1").fetchone() is not None:
+                self.conn.close()
+                raise ValueError("export store has data of an unknown course instance, use a new --sqlite_path")
+            with self.conn:
+                self.conn.execute("INSERT INTO store_info VALUES ('course_instance', ?)", (course_instance,))
+        elif row[0] != course_instance:
+            self.conn.close()
+            raise ValueError(f"export store is for course instance {row[0]}, not {course_instance}, use another --sqlite_path")
+
+    def has(self, url):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM fetched WHERE url = ?", (url,)).fetchone() is not None
+
+    """
+    Store one api response.
+    @param kind, "assessments", "gradebook", "assessment_instances", "instance_questions", "submissions" or "log"
+    @param key, assessment_id for assessment_instances, assessment_instance_id for per instance kinds
+    @param url, api url the body came from
+    @param body, response body
+    """
+    def put(self, kind, key, url, body):
+        rows = json.loads(body)
+        with self.lock:
+            with self.conn:
+                if kind == "assessments":
+                    self.conn.executemany("INSERT OR REPLACE INTO assessment VALUES (?, ?)",
+                                          [(r["assessment_id"], json.dumps(r)) for r in rows])
+                elif kind == "gradebook":
+                    self.conn.executemany("INSERT OR REPLACE INTO gradebook VALUES (?, ?)",
+                                          [(r.get("user_uid"), json.dumps(r)) for r in rows])
+                elif kind == "assessment_instances":
+                    self.conn.executemany("INSERT OR REPLACE INTO assessment_instance VALUES (?, ?, ?)",
+                                          [(r["assessment_instance_id"], key, json.dumps(r)) for r in rows])
+                elif kind == "instance_questions":
+                    self.conn.executemany("INSERT OR REPLACE INTO instance_question VALUES (?, ?, ?)",
+                                          [(r["instance_question_id"], key, json.dumps(r)) for r in rows])
+                elif kind == "submissions":
+                    self.conn.executemany("INSERT OR REPLACE INTO submission VALUES (?, ?, ?)",
+                                          [(r["submission_id"], key, json.dumps(r)) for r in rows])
+                elif kind == "log":
+                    self.conn.execute("DELETE FROM log_event WHERE assessment_instance_id = ?", (key,))
+                    self.conn.executemany("INSERT INTO log_event VALUES (?, ?, ?, ?, ?, ?)",
+                                          [(key, seq, r.get("event_date"), r.get("event_name"), r.get("submission_id"), json.dumps(r))
+                                           for seq, r in enumerate(rows)])
+                else:
+                    raise ValueError(f"unknown export kind {kind}")
+                self.conn.execute("INSERT OR REPLACE INTO fetched VALUES (?, ?)", (url, time.time()))
+
+    def assessmentIds(self):
+        with self.lock:
+            return [r[0] for r in self.conn.execute("SELECT assessment_id FROM assessment ORDER BY assessment_id")]
+
+    """
+    @return assessment_instance_id -> api object of every instance stored for the assessment
+    """
+    def instanceSnapshot(self, assessment_id):
+        with self.lock:
+            return {r[0]: json.loads(r[1]) for r in self.conn.execute(
+                "SELECT assessment_instance_id, data FROM assessment_instance WHERE assessment_id = ?", (assessment_id,))}
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
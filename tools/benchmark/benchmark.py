@@ -0,0 +1,197 @@
+import argparse
+import csv
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+from mock_prairielearn import MockCourse, MockPrairieLearnServer
+
+"""
+Offline end to end benchmark of download.py, api_download.py and match.py.
+Starts a mock PrairieLearn api in this process, points every tool at it with
+--pl_server, and runs each tool as a child process with tools/benchmark/fake_box
+on PYTHONPATH, so their box calls land in a local folder instead of box.com.
+Reports wall time, peak RSS and throughput of every stage.
+"""
+
+TOOLS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_BOX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_box")
+COURSE_INSTANCE = 1
+BOX_FOLDER_ID = "1"
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--stages", help="comma separated stages to run, match needs download", default="download,api_download,match")
+parser.add_argument("--workdir", help="directory for benchmark data, temp directory if not given", default="")
+parser.add_argument("--output", help="path to store benchmark result json", default="")
+parser.add_argument("--instances", help="number of assessment instances", type=int, default=2000)
+parser.add_argument("--assessments", help="number of assessments", type=int, default=20)
+parser.add_argument("--events_per_log", help="events in each assessment instance log", type=int, default=40)
+parser.add_argument("--event_payload_bytes", help="size of data payload of each event", type=int, default=200)
+parser.add_argument("--submissions_per_instance", help="log events carrying a submission_id per instance", type=int, default=5)
+parser.add_argument("--empty_rate", help="fraction of instance ids with empty log", type=float, default=0.05)
+parser.add_argument("--error_rate", help="fraction of api requests answered with 503", type=float, default=0.0)
+parser.add_argument("--latency", help="seconds added to every api response", type=float, default=0.02)
+parser.add_argument("--latency_per_kb", help="seconds added per KB of api response", type=float, default=0.0)
+parser.add_argument("--max_inflight", help="api answers 429 above this many concurrent requests, 0 for no limit", type=int, default=0)
+parser.add_argument("--box_latency", help="seconds added to every fake box call", type=float, default=0.0)
+parser.add_argument("--box_mbps", help="fake box transfer speed in MB/s, 0 for no limit", type=float, default=0.0)
+parser.add_argument("--thread_num", help="--thread_num passed to download.py", type=int, default=16)
+parser.add_argument("--download_batch", help="--download_batch passed to download.py", type=int, default=25)
+parser.add_argument("--download_args", help="extra arguments appended to download.py command line", default="")
+parser.add_argument("--api_download_args", help="extra arguments appended to api_download.py command line", default="")
+parser.add_argument("--match_args", help="extra arguments appended to match.py command line", default="")
+
+"""
+Run a tool as child process and measure it.
+@return dictionary with wall_seconds, peak_rss_mb, returncode
+"""
+def runStage(cmd, env, log_path):
+    started = time.time()
+    with open(log_path, "w") as log:
+        proc = subprocess.Popen(cmd, env = env, stdout = log, stderr = subprocess.STDOUT, stdin = subprocess.DEVNULL)
+        # wait4 gives resource usage of this child only
+        _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return {"wall_seconds": time.time() - started,
+            "peak_rss_mb": rusage.ru_maxrss / 1024,
+            "returncode": proc.returncode,
+            "log": log_path}
+
+"""
+Write all_submissions csv files, one per assessment, matching the submissions in mock logs.
+@return number of csv rows written
+"""
+def writeSubmissionCsvs(course, csv_dir):
+    os.makedirs(csv_dir, exist_ok = True)
+    rows = 0
+    for assessment_id in range(1, course.assessments + 1):
+        with open(os.path.join(csv_dir, f"assessment_{assessment_id}_all_submissions.csv"), "w", newline = "") as f:
+            writer = csv.writer(f)
+            writer.writerow(["submission_id", "Usernames", "qid", "submission_date", "score_perc"])
+            for instance_id in course.assessmentInstanceIds(assessment_id):
+                for submission_id in course.submissionIds(instance_id):
+                    writer.writerow([submission_id, f"student{instance_id}@example.com", f"q{submission_id % 10}",
+                                     course.instanceDate(instance_id).strftime("%Y-%m-%d"), 100])
+                    rows += 1
+    return rows
+
+def countFiles(path):
+    return sum(len(files) for _, _, files in os.walk(path))
+
+"""
+@param box_root, FAKE_BOX_ROOT of the run
+@return number of log files in zips uploaded to the benchmark box folder
+"""
+def countUploadedLogs(box_root):
+    index_path = os.path.join(box_root, "index.json")
+    if not os.path.exists(index_path):
+        return 0
+    with open(index_path) as f:
+        files = json.load(f)["files"]
+    count = 0
+    for file_id, meta in files.items():
+        if meta["folder_id"] == BOX_FOLDER_ID and meta["name"].endswith(".zip"):
+            with zipfile.ZipFile(os.path.join(box_root, "files", str(file_id))) as zf:
+                count += sum(1 for name in zf.namelist() if name.endswith(".json"))
+    return count
+
+"""
+@return number of rows in match result json, 0 if there is none
+"""
+def countResultRows(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return len(json.load(f))
+
+
+def main(args):
+    workdir = args.workdir if args.workdir else tempfile.mkdtemp(prefix = "pl_benchmark_")
+    os.makedirs(workdir, exist_ok = True)
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    course = MockCourse(**vars(args))
+    server = MockPrairieLearnServer(0, course, args.latency, args.latency_per_kb, args.error_rate, args.max_inflight)
+    server.startThread()
+
+    box_root = os.path.join(workdir, "box")
+    box_config = os.path.join(workdir, "box_config.json")
+    with open(box_config, "w") as f:
+        f.write("{}")
+    env = dict(os.environ)
+    env["PYTHONPATH"] = FAKE_BOX_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    env["FAKE_BOX_ROOT"] = box_root
+    env["FAKE_BOX_LATENCY"] = str(args.box_latency)
+    env["FAKE_BOX_MBPS"] = str(args.box_mbps)
+    end_date = course.instanceDate(course.instances)
+
+    results = {"config": vars(args), "workdir": workdir, "stages": {}}
+    for stage in stages:
+        requests_before = server.requests
+        if stage == "download":
+            # a fresh box folder and download state every run, leftovers make every upload a 409 retried with backoff
+            shutil.rmtree(box_root, ignore_errors = True)
+            shutil.rmtree(os.path.join(workdir, "zips"), ignore_errors = True)
+            for name in ["download_manifest.sqlite", "instance_index.sqlite"]:
+                for suffix in ["", "-wal", "-shm"]:
+                    if os.path.exists(os.path.join(workdir, name + suffix)):
+                        os.remove(os.path.join(workdir, name + suffix))
+            cmd = [sys.executable, os.path.join(TOOLS_DIR, "download_log", "download.py"),
+                   "--thread_num", str(args.thread_num), "--download_batch", str(args.download_batch),
+                   "--api_token", "benchmark", "--course_instance", str(COURSE_INSTANCE), "--pl_server", server.url,
+                   "--box_config_path", box_config, "--box_folder_id", BOX_FOLDER_ID,
+                   "--start_date", course.start_date.strftime("%Y-%m-%d"), "--end_date", end_date.strftime("%Y-%m-%d"),
+                   "--zip_path", os.path.join(workdir, "zips"),
+                   "--manifest_path", os.path.join(workdir, "download_manifest.sqlite"),
+                   "--index_path", os.path.join(workdir, "instance_index.sqlite")] + args.download_args.split()
+            result = runStage(cmd, env, os.path.join(workdir, "download.log"))
+            result["items"] = countUploadedLogs(box_root)
+        elif stage == "api_download":
+            shutil.rmtree(os.path.join(workdir, "export"), ignore_errors = True)
+            cmd = [sys.executable, os.path.join(TOOLS_DIR, "api_download", "api_download.py"),
+                   "--course_instance", str(COURSE_INSTANCE), "--access_token", "benchmark", "--pl_server", server.url,
+                   "--root_path", workdir, "--folder", "export"] + args.api_download_args.split()
+            result = runStage(cmd, env, os.path.join(workdir, "api_download.log"))
+            result["items"] = countFiles(os.path.join(workdir, "export"))
+        elif stage == "match":
+            shutil.rmtree(os.path.join(workdir, "match_data"), ignore_errors = True)
+            for name in ["result.json", "instance_submission_match.json", "instance_submission_match.sqlite", "box_listing.json"]:
+                if os.path.exists(os.path.join(workdir, name)):
+                    os.remove(os.path.join(workdir, name))
+            writeSubmissionCsvs(course, os.path.join(workdir, "all_submissions"))
+            cmd = [sys.executable, os.path.join(TOOLS_DIR, "match_GA", "match.py"),
+                   "--box_config_path", box_config, "--box_folder_id", BOX_FOLDER_ID,
+                   "--data_dir", os.path.join(workdir, "match_data"),
+                   "--all_submission_dir", os.path.join(workdir, "all_submissions"),
+                   "--result_dir", os.path.join(workdir, "result.json"),
+                   "--match_index_path", os.path.join(workdir, "instance_submission_match.sqlite"),
+                   "--box_listing_cache", os.path.join(workdir, "box_listing.json"),
+                   "--save_instance_match_dir", os.path.join(workdir, "instance_submission_match.json"),
+                   "--load_instance_match_dir", os.path.join(workdir, "instance_submission_match.json")] + args.match_args.split()
+            result = runStage(cmd, env, os.path.join(workdir, "match.log"))
+            result["items"] = countResultRows(os.path.join(workdir, "result.json"))
+        else:
+            print(f"unknown stage {stage}, skipped")
+            continue
+        result["api_requests"] = server.requests - requests_before
+        result["items_per_second"] = result["items"] / max(result["wall_seconds"], 1e-9)
+        results["stages"][stage] = result
+
+    server.shutdown()
+    print(f"\n{'stage':<14}{'wall s':>10}{'peak RSS MB':>14}{'items':>10}{'items/s':>12}{'api req':>10}{'exit':>6}")
+    for stage, result in results["stages"].items():
+        print(f"{stage:<14}{result['wall_seconds']:>10.2f}{result['peak_rss_mb']:>14.1f}{result['items']:>10}"
+              f"{result['items_per_second']:>12.1f}{result['api_requests']:>10}{result['returncode']:>6}")
+    print(f"\nlogs and data in {workdir}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
+    return results
+
+
+if __name__ == "__main__":
+    main(parser.parse_args())
@@ -0,0 +1,10 @@
+python benchmark.py --stages download,api_download,match\
+                    --[optional] instances 2000\
+                    --[optional] latency 0.02\
+                    --[optional] error_rate 0.0\
+                    --[optional] max_inflight 0\
+                    --[optional] box_latency 0.0\
+                    --[optional] thread_num 16\
+                    --[optional] download_args "[extra download.py arguments]"\
+                    --[optional] workdir [replace this]\
+                    --[optional] output [replace this].json
@@ -0,0 +1,230 @@
+"""
+Local stand-in for the parts of boxsdk the tools use, for offline benchmarks.
+Put tools/benchmark/fake_box on PYTHONPATH and every `from boxsdk import ...`
+resolves here. Folders are directories under $FAKE_BOX_ROOT, file ids are
+assigned from a counter stored next to them. $FAKE_BOX_LATENCY adds seconds to
+every call and $FAKE_BOX_MBPS caps transfer speed, to mimic a remote service.
+"""
+import hashlib
+from datetime import datetime, timezone
+import json
+import os
+import threading
+import time
+
+from boxsdk import exception
+
+FAKE_BOX_ROOT = os.environ.get("FAKE_BOX_ROOT", "fake_box_root")
+FAKE_BOX_LATENCY = float(os.environ.get("FAKE_BOX_LATENCY", "0"))
+FAKE_BOX_MBPS = float(os.environ.get("FAKE_BOX_MBPS", "0"))
+CHUNK = 1024 * 1024
+
+lock = threading.Lock()
+
+
+def callDelay(size = 0):
+    delay = FAKE_BOX_LATENCY
+    if FAKE_BOX_MBPS > 0:
+        delay += size / (FAKE_BOX_MBPS * 1024 * 1024)
+    if delay > 0:
+        time.sleep(delay)
+
+
+def loadIndex():
+    path = os.path.join(FAKE_BOX_ROOT, "index.json")
+    if not os.path.exists(path):
+        return {"next_id": 1, "files": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def saveIndex(index):
+    os.makedirs(FAKE_BOX_ROOT, exist_ok = True)
+    path = os.path.join(FAKE_BOX_ROOT, "index.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(f"{path}.tmp", path)
+
+
+EPOCH = "1970-01-01T00:00:00+00:00"
+
+def modifiedAt():
+    return datetime.now(timezone.utc).isoformat(timespec = "microseconds")
+
+def storedPath(file_id):
+    return os.path.join(FAKE_BOX_ROOT, "files", str(file_id))
+
+
+class JWTAuth:
+    @classmethod
+    def from_settings_file(cls, settings_file_sys_path, **_):
+        if not os.path.exists(settings_file_sys_path):
+            raise exception.BoxOAuthException(400, f"no settings file {settings_file_sys_path}")
+        return cls()
+
+
+class Client:
+    def __init__(self, oauth = None, **_):
+        self.auth = oauth
+
+    def folder(self, folder_id):
+        return Folder(str(folder_id))
+
+    def file(self, file_id):
+        return File(str(file_id))
+
+
+class Item:
+    def __init__(self, item_id, name, size, sha1, modified_at = EPOCH):
+        self.id = item_id
+        self.object_id = item_id
+        self.type = "file"
+        self.name = name
+        self.size = size
+        self.sha1 = sha1
+        self.modified_at = modified_at
+
+    @classmethod
+    def fromMeta(cls, item_id, meta):
+        return cls(item_id, meta["name"], meta["size"], meta["sha1"], meta.get("modified_at", EPOCH))
+
+
+class Folder:
+    def __init__(self, folder_id):
+        self.object_id = folder_id
+        self.id = folder_id
+
+    """
+    Pages through folder items like boxsdk does, limit is the page size.
+    sort = "date" orders by modified_at, ascending unless direction = "DESC", otherwise items are in id order.
+    """
+    def get_items(self, limit = None, offset = 0, marker = None, use_marker = False, sort = None, direction = None, fields = None):
+        with lock:
+            files = loadIndex()["files"]
+        items = [Item.fromMeta(file_id, meta) for file_id, meta in files.items() if meta["folder_id"] == self.id]
+        items.sort(key = lambda item: int(item.id))
+        if sort == "date":
+            items.sort(key = lambda item: item.modified_at, reverse = direction == "DESC")
+        page = limit if limit else 100
+        for start in range(offset, len(items), page):
+            callDelay()
+            for item in items[start:start + page]:
+                yield item
+
+    def upload(self, file_path, file_name = None, **_):
+        with open(file_path, "rb") as f:
+            return self.upload_stream(f, file_name if file_name else os.path.basename(file_path))
+
+    def upload_stream(self, file_stream, file_name, **_):
+        callDelay()
+        with lock:
+            index = loadIndex()
+            for existing_id, meta in index["files"].items():
+                if meta["folder_id"] == self.id and meta["name"] == file_name:
+                    # box names the conflicting file in context_info
+                    raise exception.BoxAPIException(409, "item_name_in_use", "Item with the same name already exists",
+                                                    context_info = {"conflicts": {"type": "file", "id": existing_id, "sha1": meta["sha1"], "name": file_name}})
+            file_id = str(index["next_id"])
+            index["next_id"] += 1
+            saveIndex(index)
+        os.makedirs(os.path.join(FAKE_BOX_ROOT, "files"), exist_ok = True)
+        sha1 = hashlib.sha1(); size = 0
+        with open(storedPath(file_id), "wb") as out:
+            while True:
+                chunk = file_stream.read(CHUNK)
+                if not chunk:
+                    break
+                callDelay(len(chunk))
+                sha1.update(chunk)
+                size += len(chunk)
+                out.write(chunk)
+        with lock:
+            index = loadIndex()
+            index["files"][file_id] = {"folder_id": self.id, "name": file_name, "size": size, "sha1": sha1.hexdigest(), "modified_at": modifiedAt()}
+            saveIndex(index)
+        return File(file_id)
+
+    def create_upload_session(self, file_size, file_name):
+        callDelay()
+        return UploadSession(self, file_size, file_name)
+
+
+class UploadSession:
+    part_size = 8 * 1024 * 1024
+
+    def __init__(self, folder, total_size, file_name):
+        self.folder = folder
+        self.total_size = total_size
+        self.file_name = file_name
+        self.parts = {}
+        self.lock = threading.Lock()
+
+    def upload_part_bytes(self, part_bytes, offset, total_size, part_content_sha1 = None):
+        callDelay(len(part_bytes))
+        with self.lock:
+            self.parts[offset] = part_bytes
+        return {"part_id": f"{offset:016x}", "offset": offset, "size": len(part_bytes), "sha1": hashlib.sha1(part_bytes).hexdigest()}
+
+    def commit(self, content_sha1, parts = None, **_):
+        data = b"".join(self.parts[offset] for offset in sorted(self.parts))
+        if hashlib.sha1(data).digest() != content_sha1 or len(data) != self.total_size:
+            raise exception.BoxAPIException(412, "precondition_failed", "sha1 or size mismatch")
+        from io import BytesIO
+        return self.folder.upload_stream(BytesIO(data), self.file_name)
+
+    def abort(self):
+        self.parts.clear()
+        return True
+
+
+class File:
+    def __init__(self, file_id):
+        self.object_id = file_id
+        self.id = file_id
+
+    def meta(self):
+        with lock:
+            meta = loadIndex()["files"].get(self.id)
+        if meta is None:
+            raise exception.BoxAPIException(404, "not_found", f"file {self.id} not found")
+        return meta
+
+    def get(self, fields = None, **_):
+        callDelay()
+        meta = self.meta()
+        return Item.fromMeta(self.id, meta)
+
+    def download_to(self, writeable_stream, byte_range = None, **_):
+        # boxsdk writes bytes={start}- only for a 1-tuple, any other end goes into the header as is
+        if byte_range is not None and (len(byte_range) not in (1, 2) or (len(byte_range) == 2 and not isinstance(byte_range[1], int))):
+            raise ValueError(f"boxsdk would send Range: bytes={'-'.join(str(b) for b in byte_range)}, use (start,) or (start, end)")
+        self.meta()
+        callDelay()
+        with open(storedPath(self.id), "rb") as f:
+            if byte_range is not None:
+                f.seek(byte_range[0])
+            remaining = None if byte_range is None or len(byte_range) == 1 else byte_range[1] - byte_range[0] + 1
+            while True:
+                chunk = f.read(CHUNK if remaining is None else min(CHUNK, remaining))
+                if not chunk:
+                    break
+                callDelay(len(chunk))
+                writeable_stream.write(chunk)
+                if remaining is not None:
+                    remaining -= len(chunk)
+
+    def content(self, byte_range = None, **_):
+        from io import BytesIO
+        buffer = BytesIO()
+        self.download_to(buffer, byte_range)
+        return buffer.getvalue()
+
+    def delete(self, **_):
+        callDelay()
+        with lock:
+            index = loadIndex()
+            if index["files"].pop(self.id, None) is None:
+                raise exception.BoxAPIException(404, "not_found", f"file {self.id} not found")
+            saveIndex(index)
+        os.remove(storedPath(self.id))
+        return True
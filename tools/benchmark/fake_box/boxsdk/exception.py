@@ -0,0 +1,18 @@
+class BoxException(Exception):
+    pass
+
+
+class BoxAPIException(BoxException):
+    def __init__(self, status, code = None, message = None, context_info = None, **_):
+        super().__init__(f"{status} {code}: {message}")
+        self.status = status
+        self.code = code
+        self.message = message
+        self.context_info = context_info
+
+
+class BoxOAuthException(BoxException):
+    def __init__(self, status, message = None, **_):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
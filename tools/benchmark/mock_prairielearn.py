@@ -0,0 +1,193 @@
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--port", help="port to listen on", type=int, default=8000)
+parser.add_argument("--instances", help="number of assessment instances", type=int, default=5000)
+parser.add_argument("--assessments", help="number of assessments instances are spread over", type=int, default=20)
+parser.add_argument("--events_per_log", help="events in each assessment instance log", type=int, default=40)
+parser.add_argument("--event_payload_bytes", help="size of data payload of each event", type=int, default=200)
+parser.add_argument("--submissions_per_instance", help="log events carrying a submission_id per instance", type=int, default=5)
+parser.add_argument("--empty_rate", help="fraction of instance ids with empty log", type=float, default=0.05)
+parser.add_argument("--error_rate", help="fraction of requests answered with 503", type=float, default=0.0)
+parser.add_argument("--latency", help="seconds added to every response", type=float, default=0.02)
+parser.add_argument("--latency_per_kb", help="seconds added per KB of response", type=float, default=0.0)
+parser.add_argument("--max_inflight", help="answer 429 above this many concurrent requests, 0 for no limit", type=int, default=0)
+parser.add_argument("--start_date", help="date of first instance", default="2021-01-01")
+parser.add_argument("--days", help="days instance creation dates are spread over", type=int, default=100)
+parser.add_argument("--seed", help="seed of generated data", type=int, default=0)
+
+ROUTES = [
+    ("log", re.compile(r"^/pl/api/v1/course_instances/(\d+)/assessment_instances/(\d+)/log$")),
+    ("instance_questions", re.compile(r"^/pl/api/v1/course_instances/(\d+)/assessment_instances/(\d+)/instance_questions$")),
+    ("submissions", re.compile(r"^/pl/api/v1/course_instances/(\d+)/assessment_instances/(\d+)/submissions$")),
+    ("assessment_instances", re.compile(r"^/pl/api/v1/course_instances/(\d+)/assessments/(\d+)/assessment_instances$")),
+    ("assessments", re.compile(r"^/pl/api/v1/course_instances/(\d+)/assessments$")),
+    ("gradebook", re.compile(r"^/pl/api/v1/course_instances/(\d+)/gradebook$")),
+]
+
+"""
+Deterministic course data served by the mock.
+Instance ids 1..instances exist, creation dates grow linearly over days, a stable
+empty_rate fraction of them have empty logs. Instance i belongs to assessment
+i % assessments + 1 and to group student{i}@example.com, and its submissions are i * 1000 + k.
+"""
+class MockCourse:
+    def __init__(self, instances = 5000, assessments = 20, events_per_log = 40, event_payload_bytes = 200,
+                 submissions_per_instance = 5, empty_rate = 0.05, start_date = "2021-01-01", days = 100, seed = 0, **_):
+        self.instances = instances
+        self.assessments = assessments
+        self.events_per_log = events_per_log
+        self.event_payload_bytes = event_payload_bytes
+        self.submissions_per_instance = min(submissions_per_instance, events_per_log)
+        self.empty_rate = empty_rate
+        self.start_date = datetime.strptime(start_date, "%Y-%m-%d")
+        self.days = days
+        self.seed = seed
+        self.log = lru_cache(maxsize = 4096)(self.buildLog)
+
+    def isEmpty(self, instance_id):
+        if instance_id < 1 or instance_id > self.instances:
+            return True
+        return zlib.crc32(f"{self.seed}:{instance_id}".encode()) % 10000 < self.empty_rate * 10000
+
+    def instanceDate(self, instance_id):
+        return self.start_date + timedelta(days = (instance_id - 1) * self.days // max(self.instances, 1))
+
+    def submissionIds(self, instance_id):
+        if self.isEmpty(instance_id):
+            return []
+        return [instance_id * 1000 + k for k in range(self.submissions_per_instance)]
+
+    def buildLog(self, instance_id):
+        if self.isEmpty(instance_id):
+            return b"[]"
+        rng = random.Random(instance_id * 7919 + self.seed)
+        date = self.instanceDate(instance_id)
+        submissions = self.submissionIds(instance_id)
+        events = []
+        for k in range(self.events_per_log):
+            event_date = date + timedelta(seconds = k * 30)
+            events.append({"event_name": "Submission" if k < len(submissions) else "View variant",
+                           "event_date": event_date.strftime("%Y-%m-%dT%H:%M:%S.000-05"),
+                           "user_uid": f"student{instance_id}@example.com",
+                           "instance_question_id": instance_id * 10 + k % 10,
+                           "submission_id": submissions[k] if k < len(submissions) else None,
+                           "data": {"payload": rng.randbytes(self.event_payload_bytes // 2 + 1).hex()[:self.event_payload_bytes]}})
+        return json.dumps(events).encode()
+
+    def assessmentInstanceIds(self, assessment_id):
+        return [i for i in range(1, self.instances + 1) if i % self.assessments + 1 == assessment_id and not self.isEmpty(i)]
+
+    """
+    @return body of an api endpoint, None if route unknown
+    """
+    def respond(self, route, args):
+        if route == "log":
+            return self.log(int(args[1]))
+        if route == "assessments":
+            return json.dumps([{"assessment_id": a, "assessment_name": f"Assessment {a}"} for a in range(1, self.assessments + 1)]).encode()
+        if route == "gradebook":
+            return json.dumps([{"user_uid": f"student{i}@example.com"} for i in range(1, min(self.instances, 1000) + 1)]).encode()
+        if route == "assessment_instances":
+            return json.dumps([{"assessment_instance_id": i, "assessment_id": int(args[1])} for i in self.assessmentInstanceIds(int(args[1]))]).encode()
+        if route == "instance_questions":
+            return json.dumps([{"instance_question_id": int(args[1]) * 10 + q} for q in range(3)]).encode()
+        if route == "submissions":
+            return json.dumps([{"submission_id": s} for s in self.submissionIds(int(args[1]))]).encode()
+        return None
+
+
+"""
+HTTP server answering PrairieLearn api routes from a MockCourse, with configurable latency,
+random 503 errors and 429 throttling above max_inflight concurrent requests.
+"""
+class MockPrairieLearnServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port, course, latency = 0.02, latency_per_kb = 0.0, error_rate = 0.0, max_inflight = 0, seed = 0):
+        super().__init__(("127.0.0.1", port), MockPrairieLearnHandler)
+        self.course = course
+        self.latency = latency
+        self.latency_per_kb = latency_per_kb
+        self.error_rate = error_rate
+        self.max_inflight = max_inflight
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.requests = 0
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def handle_error(self, request, client_address):
+        # clients hanging up early, like a probe that stops reading after the first event, are expected
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+    def startThread(self):
+        thread = threading.Thread(target = self.serve_forever, daemon = True)
+        thread.start()
+        return thread
+
+
+class MockPrairieLearnHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes, with Nagle on a kept alive connection waits for delayed ack
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.inflight += 1
+            server.requests += 1
+            throttled = server.max_inflight > 0 and server.inflight > server.max_inflight
+            failed = server.rng.random() < server.error_rate
+        try:
+            path = self.path.split("?")[0]
+            if throttled:
+                time.sleep(server.latency)
+                return self.reply(429, b'{"message": "Too Many Requests"}', {"Retry-After": "1"})
+            if failed:
+                time.sleep(server.latency)
+                return self.reply(503, b'{"message": "Service Unavailable"}')
+            for route, pattern in ROUTES:
+                match = pattern.match(path)
+                if match:
+                    body = server.course.respond(route, match.groups())
+                    time.sleep(server.latency + server.latency_per_kb * len(body) / 1024)
+                    return self.reply(200, body)
+            self.reply(404, b'{"message": "Not Found"}')
+        finally:
+            with server.lock:
+                server.inflight -= 1
+
+    def reply(self, status, body, headers = {}):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        return
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    course = MockCourse(**vars(args))
+    server = MockPrairieLearnServer(args.port, course, args.latency, args.latency_per_kb, args.error_rate, args.max_inflight, args.seed)
+    print(f"mock PrairieLearn serving {args.instances} instances on {server.url}")
+    server.serve_forever()
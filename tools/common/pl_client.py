@@ -0,0 +1,219 @@
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+"""
+Client of the PrairieLearn course instance api shared by download_log and api_download.
+One pooled keep-alive session serves every thread. Requests are rate limited,
+429, 5xx, timeouts and connection errors are retried with backoff, and files
+are written to a temp file and renamed so a file on disk is always complete.
+"""
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+EVENT_DATE_PATTERN = re.compile(rb'"event_date"\s*:\s*"(\d{4}-\d{2}-\d{2})')
+
+
+class PrairieLearnError(Exception):
+    """
+    @param url, api path that failed
+    @param status, http status code, None if request raised
+    """
+    def __init__(self, url, status, message = ""):
+        super().__init__(f"{url} failed with status {status} {message}".strip())
+        self.url = url
+        self.status = status
+
+
+"""
+Token bucket rate limit shared by every thread using a client.
+rate <= 0 means unlimited.
+"""
+class TokenBucket:
+    """
+    @param rate, requests per second
+    @param burst, max requests sent back to back after an idle period
+    """
+    def __init__(self, rate, burst = None):
+        self.rate = rate
+        self.burst = burst if burst else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    """
+    Block until a token is available.
+    @param stop_event, set when the caller is shutting down
+    @return False if stopped while waiting
+    """
+    def acquire(self, stop_event):
+        if self.rate <= 0:
+            return not stop_event.is_set()
+        while not stop_event.is_set():
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            stop_event.wait(wait)
+        return False
+
+
+"""
+@param value, Retry-After header, seconds or http date
+@return seconds to wait, None if header missing or not understood
+"""
+def parseRetryAfter(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+"""
+Write data next to path and rename, so path either does not exist or is complete.
+"""
+def atomicWrite(path, data):
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(data)
+    os.replace(f"{path}.tmp", path)
+
+
+class PrairieLearnClient:
+    """
+    @param server, PrairieLearn server url, e.g. https://www.prairielearn.org
+    @param course_instance, course instance id
+    @param token, api access token
+    @param pool_size, connections kept alive, at least the number of threads sharing the client
+    @param timeout, (connect, read) seconds
+    @param max_retries, retries of a request on 429, 5xx, timeout or connection error
+    @param rate_limit, max requests per second, 0 for no limit
+    @param rate_burst, max requests sent back to back under rate_limit
+    """
+    def __init__(self, server, course_instance, token, pool_size = 16, timeout = (10, 300), max_retries = 5, rate_limit = 0, rate_burst = 0):
+        self.base_url = f"{server.rstrip('/')}/pl/api/v1/course_instances/{course_instance}"
+        self.token = token
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.rate_limiter = TokenBucket(rate_limit, rate_burst)
+        self.never_stop = threading.Event()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    """
+    Send a single rate limited request, no retry.
+    @param path, api path under the course instance, e.g. /assessments
+    @param stream, leave body unread for iter_content
+    @param stop_event, stops waiting for rate limit
+    @return requests.Response, None if stopped while waiting
+    """
+    def send(self, path, stream = False, stop_event = None):
+        if not self.rate_limiter.acquire(stop_event if stop_event is not None else self.never_stop):
+            return None
+        return self.session.get(self.base_url + path, params = {"private_token": self.token}, timeout = self.timeout, stream = stream)
+
+    """
+    Get path, retrying with exponential backoff or Retry-After.
+    @return requests.Response with status 200
+    @raise PrairieLearnError if status is not retryable or retries run out
+    """
+    def get(self, path, stream = False):
+        for attempt in range(self.max_retries + 1):
+            response = None; error = ""
+            try:
+                response = self.send(path, stream)
+                if response.status_code == 200:
+                    return response
+                if response.status_code not in RETRY_STATUS:
+                    raise PrairieLearnError(path, response.status_code)
+                response.close()
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+            if attempt == self.max_retries:
+                raise PrairieLearnError(path, None if response is None else response.status_code, f"after {attempt + 1} attempts {error}")
+            wait = None if response is None else parseRetryAfter(response.headers.get("Retry-After"))
+            time.sleep(wait if wait is not None else min(2 ** attempt, 60))
+
+    def getBytes(self, path):
+        return self.get(path).content
+
+    def getJson(self, path):
+        return json.loads(self.getBytes(path))
+
+    """
+    Save path to file, written to a temp file and renamed.
+    @return response body
+    """
+    def download(self, path, file_path):
+        body = self.getBytes(path)
+        atomicWrite(file_path, body)
+        return body
+
+    """
+    Read the date of the first event of an assessment instance log without downloading the whole log.
+    @return "YYYY-MM-DD" of first event, None if instance has no log
+    """
+    def firstEventDate(self, instance_id):
+        with self.get(self.logPath(instance_id), stream = True) as response:
+            head = b""
+            # first event_date sits in the first event, stop reading as soon as it shows up
+            for chunk in response.iter_content(chunk_size = 8192):
+                head += chunk
+                match = EVENT_DATE_PATTERN.search(head)
+                if match:
+                    return match.group(1).decode()
+        return None
+
+    # api paths
+    def assessmentsPath(self):
+        return "/assessments"
+
+    def gradebookPath(self):
+        return "/gradebook"
+
+    def assessmentInstancesPath(self, assessment_id):
+        return f"/assessments/{assessment_id}/assessment_instances"
+
+    def instanceQuestionsPath(self, instance_id):
+        return f"/assessment_instances/{instance_id}/instance_questions"
+
+    def submissionsPath(self, instance_id):
+        return f"/assessment_instances/{instance_id}/submissions"
+
+    def logPath(self, instance_id):
+        return f"/assessment_instances/{instance_id}/log"
+
+    # typed endpoints, parsed json
+    def assessments(self):
+        return self.getJson(self.assessmentsPath())
+
+    def gradebook(self):
+        return self.getJson(self.gradebookPath())
+
+    def assessmentInstances(self, assessment_id):
+        return self.getJson(self.assessmentInstancesPath(assessment_id))
+
+    def instanceQuestions(self, instance_id):
+        return self.getJson(self.instanceQuestionsPath(instance_id))
+
+    def submissions(self, instance_id):
+        return self.getJson(self.submissionsPath(instance_id))
+
+    def log(self, instance_id):
+        return self.getJson(self.logPath(instance_id))
@@ -0,0 +1,157 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from boxsdk import JWTAuth, Client
+from boxsdk.exception import BoxAPIException
+
+# box only accepts upload sessions for files of at least 20MB
+CHUNKED_UPLOAD_MIN = 20 * 1024 * 1024
+
+"""
+Box upload engine shared by every upload thread of the process.
+Authenticates once, JWTAuth refreshes the access token by itself when it expires.
+Files over chunked_threshold go through the chunked upload session api with
+part_workers parts in flight at once.
+"""
+class BoxUploader:
+    """
+    @param config_path, box configuration json file path
+    @param folder_id, box folder to upload into
+    @param part_workers, parallel parts per chunked upload
+    @param chunked_threshold, smallest file in bytes uploaded in chunks
+    """
+    def __init__(self, config_path, folder_id, part_workers = 4, chunked_threshold = CHUNKED_UPLOAD_MIN):
+        self.config_path = config_path
+        self.folder_id = folder_id
+        self.part_workers = part_workers
+        self.chunked_threshold = max(chunked_threshold, CHUNKED_UPLOAD_MIN)
+        self.lock = threading.Lock()
+        self.client = None
+
+    """
+    @return authenticated box client, created on first use
+    """
+    def getClient(self):
+        with self.lock:
+            if self.client is None:
+                self.client = Client(JWTAuth.from_settings_file(self.config_path))
+            return self.client
+
+    """
+    Upload file to box folder.
+    A file of the same name with the same size and sha1 already in the folder counts as uploaded,
+    e.g. a zip a crashed run uploaded but never recorded.
+    @param path, local file path
+    @return box file id
+    """
+    def upload(self, path):
+        size = os.path.getsize(path)
+        folder = self.getClient().folder(self.folder_id)
+        try:
+            if size < self.chunked_threshold:
+                return folder.upload(path).id
+            return self.uploadChunked(folder, path, size).id
+        except BoxAPIException as e:
+            if e.status != 409:
+                raise
+            file_id = self.existingCopy(folder, path, size, e)
+            if file_id is None:
+                raise
+            return file_id
+
+    """
+    Find the file a 409 item_name_in_use conflicts with.
+    @param error, the 409 BoxAPIException, its context_info names the conflicting file
+    @return box file id if that file has the size and sha1 of path, None otherwise
+    """
+    def existingCopy(self, folder, path, size, error):
+        conflicts = (getattr(error, "context_info", None) or {}).get("conflicts")
+        if isinstance(conflicts, list):
+            conflicts = conflicts[0] if conflicts else None
+        file_id = conflicts.get("id") if conflicts else None
+        if file_id is None:
+            name = os.path.basename(path)
+            file_id = next((item.id for item in folder.get_items(limit = 1000, use_marker = True, fields = ["name"]) if item.name == name), None)
+            if file_id is None:
+                return None
+        item = self.getClient().file(file_id).get(fields = ["size", "sha1"])
+        if item.size != size or item.sha1 != fileSha1(path):
+            return None
+        return item.id
+
+    """
+    Upload file with an upload session, parts are sent in parallel while the whole file sha1 is computed in order.
+    At most 2 * part_workers parts are held in memory.
+    @return box file object
+    """
+    def uploadChunked(self, folder, path, size):
+        session = folder.create_upload_session(size, os.path.basename(path))
+        sha1 = hashlib.sha1()
+        in_flight = threading.Semaphore(self.part_workers * 2)
+        futures = []
+        try:
+            with open(path, "rb") as f, ThreadPoolExecutor(max_workers = self.part_workers) as pool:
+                offset = 0
+                while offset < size:
+                    in_flight.acquire()
+                    part = f.read(session.part_size)
+                    sha1.update(part)
+                    future = pool.submit(session.upload_part_bytes, part, offset, size)
+                    future.add_done_callback(lambda _: in_flight.release())
+                    futures.append(future)
+                    offset += len(part)
+            parts = sorted([future.result() for future in futures], key = lambda p: p["offset"])
+            return session.commit(sha1.digest(), parts = parts)
+        except Exception:
+            session.abort()
+            raise
+
+    """
+    delete file from box.
+    @param file_id, box file id
+    """
+    def delete(self, file_id):
+        self.getClient().file(file_id = file_id).delete()
+
+
+def fileSha1(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(8 * 1024 * 1024), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+"""
+Bytes of archives written locally but not uploaded yet.
+The archiver waits on it, so a slow box upload throttles downloading instead of filling the disk.
+"""
+class UploadBudget:
+    """
+    @param max_bytes, archiver blocks while more than max_bytes are waiting for upload
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.pending = 0
+        self.cond = threading.Condition()
+
+    def add(self, size):
+        with self.cond:
+            self.pending += size
+
+    def release(self, size):
+        with self.cond:
+            self.pending -= size
+            self.cond.notify_all()
+
+    """
+    Block until pending bytes are under budget.
+    @param stop_event, set when the pipeline is shutting down
+    @return False if stopped while waiting
+    """
+    def wait(self, stop_event):
+        with self.cond:
+            while self.pending > self.max_bytes and not stop_event.is_set():
+                self.cond.wait(timeout = 0.5)
+        return not stop_event.is_set()
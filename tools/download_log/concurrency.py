@@ -0,0 +1,76 @@
+import threading
+import time
+
+"""
+AIMD controller for the number of requests in flight.
+Every successful request raises the limit by 1 / limit, so the limit grows by about
+one per round trip. A throttled (429), failed (5xx, connection error) or congested
+request, one whose smoothed latency is over latency_tolerance times the best smoothed
+latency seen recently, cuts the limit by a factor, at most once per round trip so one burst of
+errors only counts once. Retry-After from the server pauses every worker.
+"""
+class AdaptiveConcurrency:
+    """
+    @param min_limit, lowest number of requests in flight
+    @param max_limit, highest number of requests in flight
+    @param initial, starting limit, default min_limit
+    @param latency_tolerance, smoothed latency over best smoothed latency that counts as congestion
+    """
+    def __init__(self, min_limit, max_limit, initial = None, latency_tolerance = 3.0):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial if initial else self.min_limit)))
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.ewma_latency = None
+        self.best_latency = None
+        self.last_decrease = 0.0
+        self.paused_until = 0.0
+        self.cond = threading.Condition()
+
+    """
+    Block until a request slot is free.
+    @param stop_event, set when the pipeline is shutting down
+    @return False if stopped while waiting
+    """
+    def acquire(self, stop_event):
+        with self.cond:
+            while not stop_event.is_set():
+                if self.in_flight < int(self.limit) and time.monotonic() >= self.paused_until:
+                    self.in_flight += 1
+                    return True
+                self.cond.wait(timeout = 0.1)
+        return False
+
+    """
+    Free a request slot and adjust the limit from its outcome.
+    @param latency, seconds the request took
+    @param status, http status code, None if request raised
+    @param retry_after, seconds from Retry-After header if any
+    """
+    def release(self, latency, status, retry_after = None):
+        with self.cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            failed = status is None or status == 429 or status >= 500
+            congested = False
+            if not failed:
+                self.ewma_latency = latency if self.ewma_latency is None else 0.8 * self.ewma_latency + 0.2 * latency
+                # best latency drifts up slowly so a run of naturally larger logs stops looking like congestion
+                self.best_latency = self.ewma_latency if self.best_latency is None else min(self.best_latency * 1.01, self.ewma_latency)
+                congested = self.ewma_latency > self.latency_tolerance * self.best_latency
+            if failed or congested:
+                # one decrease per round trip, requests already in flight report the same congestion
+                cooldown = self.ewma_latency if self.ewma_latency else 1.0
+                if now - self.last_decrease > cooldown:
+                    self.limit = max(self.min_limit, self.limit * (0.5 if failed else 0.9))
+                    self.last_decrease = now
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+
+    def currentLimit(self):
+        with self.cond:
+            return int(self.limit)
@@ -1,12 +1,24 @@
-import requests, json, uuid
+import json, uuid, sys
 from tqdm import tqdm
 import threading
-from datetime import datetime
+import queue
+import time
+import math
+from concurrent.futures import ThreadPoolExecutor
+import zipfile
+from datetime import datetime, timedelta
 import os
 import pandas as pd
 import argparse
-from boxsdk import JWTAuth, Client, exception
-from shutil import which
+from boxsdk import exception
+from box_uploader import BoxUploader, UploadBudget
+from concurrency import AdaptiveConcurrency
+from metrics import Metrics
+from instance_index import InstanceIndex
+from manifest import DownloadManifest
+from log_store import ColumnarLogStore, resolveFormat
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+from pl_client import PrairieLearnClient, parseRetryAfter
 
 class bcolors:
     HEADER = '\033[95m'
@@ -20,38 +32,63 @@ class bcolors:
     UNDERLINE = '\033[4m'
 
 parser = argparse.ArgumentParser()
-parser.add_argument("--download_batch", help="download chunk size", type=int)
-parser.add_argument("--thread_num", help="number of thread to download", type=int)
+parser.add_argument("--download_batch", help="zip size is thread_num * download_batch log files unless --archive_size is given", type=int, default=30)
+parser.add_argument("--thread_num", help="max number of log files downloading at once", type=int, default=32)
+parser.add_argument("--min_thread_num", help="min number of log files downloading at once", type=int, default=2)
+parser.add_argument("--archive_size", help="log files per zip", type=int, default=0)
+parser.add_argument("--rate_limit", help="max requests per second to PrairieLearn, 0 for no limit", type=float, default=0)
+parser.add_argument("--rate_burst", help="max requests sent back to back under --rate_limit", type=float, default=0)
+parser.add_argument("--max_retries", help="retries of a log file on 429, 5xx or connection error", type=int, default=5)
 parser.add_argument("--api_token", help="api access token")
+parser.add_argument("--pl_server", help="PrairieLearn server url", default="https://www.prairielearn.org")
 parser.add_argument("--course_instance", help="course instance id", type=int)
-parser.add_argument("--store_path", help="where you want to store data")
+parser.add_argument("--store_path", help="unused, log files are streamed into zip_path")
 parser.add_argument("--zip_path", help="where you want to store zip data")
 parser.add_argument("--box_config_path", help="box configuration json file path")
 parser.add_argument("--box_folder_id", help="box configuration json file path")
 parser.add_argument("--start_date", help="start date of log file")
 parser.add_argument("--end_date", help="end date of log file")
+parser.add_argument("--end_run", help="consecutive instance ids without log taken as the end of the instance range", type=int, default=16)
+parser.add_argument("--index_path", help="sqlite file caching first event date of probed instances", default="instance_index.sqlite")
+parser.add_argument("--manifest_path", help="sqlite file recording download progress for --resume", default="download_manifest.sqlite")
+parser.add_argument("--resume", help="continue the last run with the same course_instance, start_date and end_date", action="store_true")
+parser.add_argument("--upload_workers", help="number of zips uploading to box at once", type=int, default=2)
+parser.add_argument("--upload_part_workers", help="parallel parts per chunked box upload", type=int, default=4)
+parser.add_argument("--max_pending_upload_mb", help="pause archiving while this many MB of zips wait for upload", type=int, default=2048)
+parser.add_argument("--metrics_path", help="file rewritten with download metrics, Prometheus text if it ends with .prom, JSON otherwise", default="")
+parser.add_argument("--metrics_interval", help="seconds between metrics file rewrites", type=float, default=10)
+parser.add_argument("--queue_size", help="max downloaded log files waiting to be archived", type=int, default=0)
+parser.add_argument("--columnar_path", help="also keep logs as date partitioned columnar shards in this directory, off if not given", default="")
+parser.add_argument("--columnar_format", help="columnar shard format: auto, parquet, jsonl.zst or jsonl.gz", default="auto")
 
-download_batch = 0; total_log_count = 0;  thread_num = 0
-store_path = ""; zip_path = ""; 
-COURSE_INSTANCE = -1; API_TOKEN = ""
+download_batch = 0; total_log_count = 0;  thread_num = 0; queue_size = 0
+min_thread_num = 0; archive_size = 0; max_retries = 0
+controller = None; client = None; metrics = None
+zip_path = ""; index_path = ""; manifest_path = ""; resume = False
+COURSE_INSTANCE = -1; API_TOKEN = ""; pl_server = ""
 start_date_str = ""; end_date_str = ""
 box_config_path = ""; box_folder_id = ""
+box_uploader = None; upload_workers = 0; max_pending_upload_mb = 0
+manifest = None; instance_index = None; probe_pool = None
+columnar_path = ""; columnar_format = ""; log_store = None
+end_run = 16
+# (stage, exception) of archiver or uploader threads that died, main stops the run on the first one
+stage_errors = []
 
 """
 upload file to box.
 @param store_path, the path of zip file
 @param file_name, the name of zip
+@return ("SUCCESS", box file id) or (exception, -1)
 """
 def upload(store_path, file_name, keep_file = True):
     try:
-        config = JWTAuth.from_settings_file(box_config_path)
-        client = Client(config)
-        new_file = client.folder(box_folder_id).upload(f"{store_path}/{file_name}")
+        new_file_id = box_uploader.upload(f"{store_path}/{file_name}")
     except Exception as e:
         return e, -1
     if not keep_file:
-        os.system(f"cd {store_path} && rm {file_name} && cd ..")
-    return "SUCCESS", new_file.id
+        os.remove(f"{store_path}/{file_name}")
+    return "SUCCESS", new_file_id
 
 """
 delete file from box.
@@ -59,84 +96,89 @@ delete file from box.
 """
 def delete(file_id):
     try:
-        config = JWTAuth.from_settings_file(box_config_path)
-        client = Client(config)
-        client.file(file_id=file_id).delete()
+        box_uploader.delete(file_id)
     except Exception as e:
         return e
 
 """
-Get json data object from given url. If json file exists return loaded json, otherwise download first
-@param url, api file url
-@param path, local stored path
-@return json data object
+Get create date of assessment instances, probing the ones not in local index concurrently.
+@param instance_ids, list of assessment instance ids
+@return dictionary key = instance_id, value = datetime of first event or None if instance has no log
 """
-def getJson(start_index, end_index, need_data = False):
-    s = requests.Session()
-    for i in range(start_index, end_index):
-        url = f"https://www.prairielearn.org/pl/api/v1/course_instances/{COURSE_INSTANCE}/assessment_instances/{i}/log?private_token={API_TOKEN}"
-        path = f"{store_path}/assessment_instance_{i}_log.json"
-        if not os.path.isfile(path):
-            try:
-                with open(path, "w") as f:
-                    f.write(s.get(url).text)
-            except Exception as e:
-                print(e)
-        if need_data:
-            f = open(path)
-            return json.load(f)
-        
+def getTimes(instance_ids) -> dict:
+    dates = {}; to_probe = []
+    for instance_id in instance_ids:
+        found, first_date = instance_index.lookup(instance_id)
+        if found:
+            dates[instance_id] = first_date
+        else:
+            to_probe.append(instance_id)
+    for instance_id, first_date in zip(to_probe, probe_pool.map(client.firstEventDate, to_probe)):
+        instance_index.record(instance_id, first_date)
+        dates[instance_id] = first_date
+    return {i: None if d is None else datetime.strptime(d, "%Y-%m-%d") for i, d in dates.items()}
+
+
+"""
+Get create time of assessment instance
+
+@param assessment_instance_id, assessment instance id
+@return datatime object representing creation time
+"""
+def getTime(assessment_instance_id: int) -> datetime:
+    return getTimes([assessment_instance_id])[assessment_instance_id]
+
 
 """
-binary search for approximate range where assessment is created on the same date as target_time
+k-ary search for the first assessment instance created no earlier than target_time.
+Each round probes thread_num ids at once. Instances without log are skipped.
 
-@param end_index, ending assessment id that hope to search for
+@param low, first assessment id to search
+@param high, last assessment id to search
 @param target_time, target time expect to find
 
-@return approximate assessment instance id
+@return first assessment instance id created on or after target_time, high + 1 if none
 """
-def binary_search(end_index : int, target_time : datetime, is_lower_bound = True) -> int:
-    low = 1
-    mid = 0
-    while low <= end_index:
-        mid = (end_index + low) // 2
-        cur = None
-        while True:
-            cur = getTime(mid)
-            if cur != None:
-                break
-            mid += 1
-        if cur < target_time:
-            low = mid + 1
-        elif cur > target_time:
-            end_index = mid - 1
-        else:
-            if is_lower_bound:
-                left_time = getTime(mid - 1)
-                if left_time == target_time:
-                    end_index = mid - 1
-                else:
-                    return mid
+def searchDate(low : int, high : int, target_time : datetime) -> int:
+    k = max(thread_num, 2)
+    answer = high + 1; shift = 0
+    while low < answer:
+        if answer - low <= k:
+            # few enough left, probe all of them, first one on or after target_time is the answer
+            times = getTimes(list(range(low, answer)))
+            return next((p for p in range(low, answer) if times[p] is not None and times[p] >= target_time), answer)
+        step = (answer - low) / (k + 1)
+        if shift > math.ceil(step):
+            # every id from the first probe to answer has no log, answer is before the first probe or is answer
+            first = searchDate(low, low + int(step) - 1, target_time)
+            return first if first < low + int(step) else answer
+        points = sorted({low + int(step * (j + 1)) + shift for j in range(k)})
+        points = [p for p in points if low <= p < answer]
+        times = getTimes(points)
+        progressed = False
+        for p in points:
+            if times[p] is None:
+                continue
+            progressed = True
+            if times[p] < target_time:
+                low = p + 1
             else:
-                right_time = getTime(mid + 1)
-                if right_time == target_time:
-                    low = mid + 1
-                else:
-                    return mid
-    return -1
+                answer = p
+                break
+        # every probe hit an instance without log, move probes forward
+        shift = 0 if progressed else shift + 1
+    return answer
 
 
 """
-Get create time of assessment instance
-
-@param assessment_instance_id, assessment instance id in string format
-@return datatime object representing creation time
+An instance without log ends the range only if the next end_run - 1 ids have no log either,
+deleted instances and instances of other course instances leave gaps inside the range.
+@param instance_id, assessment instance id without log
+@return True if instance_id is past the last instance
 """
-def getTime(assessment_instance_id: str) -> datetime:
-    data = getJson(assessment_instance_id, assessment_instance_id + 1,True)
-    if len(data) == 0:
-        return None
-    return datetime.strptime(data[0]['event_date'][0:10], "%Y-%m-%d")
+def isRangeEnd(instance_id: int) -> bool:
+    times = getTimes(list(range(instance_id, instance_id + max(end_run, 1))))
+    return all(t is None for t in times.values())
 
 
 """
@@ -144,109 +186,468 @@ Get number of assessment instance created from courses taught by current instruc
 @return integer representing total number of assessment instances created
 """
 def getInstanceRange() -> int:
-    low = 1
-    high = 1000
-    # get enough ending index
+    k = max(thread_num, 2)
+    # low is inside the range, high is past the end
+    low = 0; high = 1000
+    # get enough ending index, k doublings per round
     while True:
-        data = getJson(high, high + 1, True)
-        if len(data) == 0:
+        points = [high * 2 ** j for j in range(k)]
+        times = getTimes(points)
+        end = next((p for p in points if times[p] is None and isRangeEnd(p)), None)
+        if end is not None:
+            high = end
+            low = max([p for p in points if p < high], default = low)
             break
-        else:
-            high *= 2
-        
-    # binary search to pinpoint range
-    mid = 0
-    while low <= high:
-        mid = (high + low) // 2
-        data = getJson(mid, mid + 1, True)
-        if len(data) == 0:
-            high = mid - 1
-        else:
-            data = getJson(mid + 1, mid + 2, True)
-            if len(data) == 0:
-                return mid
-            else:
-                low = mid + 1
+        low = points[-1]
+        high = points[-1] * 2
 
+    # k-ary search to pinpoint range, a gap in the range moves low like an instance with log
+    while high - low > 1:
+        step = (high - low) / (k + 1)
+        points = sorted({low + max(1, int(step * (j + 1))) for j in range(k)})
+        points = [p for p in points if low < p < high]
+        times = getTimes(points)
+        for p in points:
+            if times[p] is None and isRangeEnd(p):
+                high = p
+                break
+            low = p
+    return low
 
-def main():
-    start_index = -1; end_index = -1
+
+"""
+Put item into a bounded queue, blocking until there is room or the pipeline is stopped.
+@param q, target queue
+@param item, item to put
+@param stop_event, set when the pipeline is shutting down
+@return True if item was put
+"""
+def putUntilStopped(q, item, stop_event):
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout = 0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+"""
+Get item from a queue, blocking until one arrives or the pipeline is stopped.
+@param q, source queue
+@param stop_event, set when the pipeline is shutting down
+@return item, or None if the pipeline is stopped
+"""
+def getUntilStopped(q, stop_event):
+    while not stop_event.is_set():
+        try:
+            return q.get(timeout = 0.5)
+        except queue.Empty:
+            continue
+    return None
+
+"""
+Join thread while still letting KeyboardInterrupt reach the main thread.
+@param thread, thread to wait for
+"""
+def waitThread(thread):
+    while thread.is_alive():
+        thread.join(timeout = 0.5)
+
+"""
+Get the first instance id of the archive range instance_id belongs to.
+@param instance_id, assessment instance id
+@param start_index, first instance id of the download range
+@param archive_size, number of instance ids per zip
+@return first instance id of the archive range
+"""
+def rangeStart(instance_id, start_index, archive_size):
+    return start_index + (instance_id - start_index) // archive_size * archive_size
+
+"""
+Get the last instance id before the first gap in archived ranges.
+@param start_index, first instance id of the download range
+@param archived, list of (start, end) archived ranges
+@return last contiguous archived instance id
+"""
+def lastArchivedId(start_index, archived):
+    last = start_index - 1
+    for start, end in sorted(archived):
+        if start != last + 1:
+            break
+        last = end
+    return last
+
+"""
+Download stage. Long lived worker that downloads log files until id_queue is empty.
+Every request waits for a slot from controller and a token from the client rate limit.
+429, 5xx and connection errors put the instance id back to id_queue until max_retries,
+not to be sent again before Retry-After or an exponential backoff has passed.
+@param id_queue, priority queue of (not before monotonic time, instance id, attempt) to download
+@param log_queue, bounded queue of (instance id, response body) for archiver, body is None if download failed
+@param stop_event, set when the pipeline is shutting down
+"""
+def downloadWorker(id_queue, log_queue, stop_event):
+    while not stop_event.is_set():
+        try:
+            not_before, instance_id, attempt = id_queue.get_nowait()
+        except queue.Empty:
+            return
+        # earliest id is a retry still backing off, put it back and wait instead of sending it early
+        wait = not_before - time.monotonic()
+        if wait > 0:
+            id_queue.put((not_before, instance_id, attempt))
+            stop_event.wait(min(wait, 0.5))
+            continue
+        if not controller.acquire(stop_event):
+            return
+        body = None; status = None; retry_after = None; last_error = None
+        started = time.monotonic()
+        try:
+            # single attempt, retries go back through id_queue so controller sees every outcome
+            response = client.send(client.logPath(instance_id), stop_event = stop_event)
+            if response is None:
+                return
+            status = response.status_code
+            if status == 200:
+                body = response.content
+            elif status == 429 or status >= 500:
+                retry_after = parseRetryAfter(response.headers.get("Retry-After"))
+        except Exception as e:
+            metrics.inc("connection_errors")
+            last_error = e
+        latency = time.monotonic() - started
+        controller.release(latency, status, retry_after)
+        metrics.observeRequest(latency, status, 0 if body is None else len(body))
+        if body is None and (status is None or status == 429 or status >= 500) and attempt < max_retries:
+            delay = retry_after if retry_after is not None else min(2 ** attempt, 60)
+            id_queue.put((time.monotonic() + delay, instance_id, attempt + 1))
+            metrics.inc("retries")
+            continue
+        if body is None:
+            metrics.inc("failed_files")
+            print(f"{bcolors.FAIL} log file {instance_id} failed with status {status} {last_error if status is None else ''} {bcolors.ENDC}")
+        metrics.inc("files")
+        # time blocked here means archiver can not keep up
+        blocked = time.monotonic()
+        if not putUntilStopped(log_queue, (instance_id, body), stop_event):
+            return
+        metrics.addTime("download_blocked_on_archive", time.monotonic() - blocked)
+
+"""
+Archive stage. Stream every log file straight into the zip of its archive range,
+and hand the range to uploader as soon as it is complete.
+Ranges are written to {start}_{end}.zip.part and renamed when closed, so a zip
+named {start}_{end}.zip is always complete. Failed downloads are left out of the
+zip and recorded as failed in manifest. A range with failed ids is not archived,
+its .part is closed and marked partial, and --resume downloads just the missing ids.
+@param log_queue, bounded queue of (instance id, response body)
+@param upload_queue, bounded queue of (range_start, range_end) for uploader
+@param stop_event, set when the pipeline is shutting down
+@param run, run dictionary from manifest
+@param open_zips, range_start -> [open ZipFile, number of instance ids done, number failed], partial ranges reopened by resume
+@param upload_budget, bytes of zips waiting for upload, archiving pauses while over budget
+"""
+def archiver(log_queue, upload_queue, stop_event, run, open_zips, upload_budget):
     try:
-        print("\nCalculate search range... ", end = "", flush = True)
-        # init temp directory to store log file and zip file
-        os.system(f"mkdir {store_path}; mkdir {zip_path}")
-        # get ending range
-        total_log_count = getInstanceRange()
-        # get start and end index of download range
-        start_date = datetime.strptime(start_date_str, "%Y-%m-%d")
-        end_date = datetime.strptime(end_date_str, "%Y-%m-%d")
-        start_index = binary_search(total_log_count, start_date, True)
-        end_index = binary_search(total_log_count, end_date, False)
-        # remove binary search temp files
-        os.system(f"cd {store_path} && rm -rf assessment_instance_*.json && cd ..")
-        print(f"from {start_index} to {end_index} \u2713", flush = True)
-    except (KeyboardInterrupt, Exception) as e:
-        if type(e) == KeyboardInterrupt:
-            print(f"\n{bcolors.WARNING}KeyboardInterrupt{bcolors.ENDC}")
-        else:
-            print(f"\n{bcolors.FAIL} ERROR: {e} {bcolors.ENDC}")
-        exit()
-    
+        while True:
+            blocked = time.monotonic()
+            if not upload_budget.wait(stop_event):
+                return
+            metrics.addTime("archive_blocked_on_upload", time.monotonic() - blocked)
+            item = getUntilStopped(log_queue, stop_event)
+            if item is None:
+                return
+            started = time.monotonic()
+            instance_id, body = item
+            range_start = rangeStart(instance_id, run["start_index"], run["archive_size"])
+            range_end = min(range_start + run["archive_size"] - 1, run["end_index"])
+            file_name = f"{range_start}_{range_end}.zip"
+            if range_start not in open_zips:
+                open_zips[range_start] = [zipfile.ZipFile(f"{zip_path}/{file_name}.part", "w", zipfile.ZIP_DEFLATED), 0, 0]
+            cur = open_zips[range_start]
+            if body is not None:
+                cur[0].writestr(f"assessment_instance_{instance_id}_log.json", body)
+            manifest.markDownloaded(run["run_id"], instance_id, body is not None)
+            cur[1] += 1
+            if body is None:
+                cur[2] += 1
+            if cur[1] < range_end - range_start + 1:
+                metrics.addTime("archive", time.monotonic() - started)
+                continue
+            if cur[2] > 0:
+                # logs missing, keep range out of box until --resume fills the gap
+                cur[0].close()
+                del open_zips[range_start]
+                manifest.markPartial(run["run_id"], range_start, range_end)
+                metrics.inc("partial_archives")
+                metrics.addTime("archive", time.monotonic() - started)
+                continue
+            # every log file in range written, close zip and pass on to uploader
+            cur[0].close()
+            del open_zips[range_start]
+            os.replace(f"{zip_path}/{file_name}.part", f"{zip_path}/{file_name}")
+            upload_budget.add(os.path.getsize(f"{zip_path}/{file_name}"))
+            manifest.markArchived(run["run_id"], range_start, range_end)
+            metrics.inc("archives")
+            metrics.addTime("archive", time.monotonic() - started)
+            if not putUntilStopped(upload_queue, (range_start, range_end), stop_event):
+                return
+    except Exception as e:
+        # e.g. disk full, stop downloading instead of blocking on a queue nobody reads
+        stageFailed("archive", e, stop_event)
+    finally:
+        # close partial zips cleanly so resume can reopen them
+        for cur in open_zips.values():
+            try:
+                cur[0].close()
+            except Exception as e:
+                print(f"{bcolors.FAIL} closing {cur[0].filename} failed: {e} {bcolors.ENDC}")
+
+"""
+Upload stage. Several uploaders share upload_queue, each uploads finished zips to box,
+records box file id and removes local copy.
+@param upload_queue, queue of (range_start, range_end)
+@param stop_event, set when the pipeline is shutting down
+@param run, run dictionary from manifest
+@param upload_budget, bytes of zips waiting for upload
+"""
+def uploader(upload_queue, stop_event, run, upload_budget):
+    try:
+        while True:
+            item = getUntilStopped(upload_queue, stop_event)
+            if item is None:
+                return
+            uploadRange(run, *item, upload_budget, stop_event)
+    except Exception as e:
+        stageFailed("upload", e, stop_event)
+
+"""
+Record the error a stage thread died of and stop the pipeline.
+@param stage, name of the stage
+@param error, exception the stage died of
+@param stop_event, set so every other stage stops waiting on queues
+"""
+def stageFailed(stage, error, stop_event):
+    stage_errors.append((stage, error))
+    print(f"{bcolors.FAIL} {stage} stage failed: {error} {bcolors.ENDC}")
+    stop_event.set()
+
+"""
+Upload a single archived range, retry with backoff before giving up.
+A range that still fails stays on disk and in manifest as archived for --resume.
+With --columnar_path the range is first written to the columnar store, while its zip is still local,
+and a range whose columnar write fails is not uploaded.
+"""
+def uploadRange(run, range_start, range_end, upload_budget, stop_event, attempts = 3):
+    file_name = f"{range_start}_{range_end}.zip"
+    size = os.path.getsize(f"{zip_path}/{file_name}")
+    if log_store is not None and not log_store.hasRange(range_start, range_end):
+        started = time.monotonic()
+        try:
+            log_store.writeRangeFromZip(range_start, range_end, f"{zip_path}/{file_name}")
+            metrics.inc("columnar_ranges")
+        except Exception as e:
+            metrics.inc("columnar_errors")
+            metrics.addTime("columnar", time.monotonic() - started)
+            # uploading would delete the only local copy, zip stays archived so --resume rebuilds the shards first
+            print(f"{bcolors.FAIL} columnar store of {file_name} failed, zip kept for --resume: {e} {bcolors.ENDC}")
+            upload_budget.release(size)
+            return
+        metrics.addTime("columnar", time.monotonic() - started)
+    for attempt in range(attempts):
+        started = time.monotonic()
+        return_message, file_id = upload(zip_path, file_name)
+        metrics.addTime("upload", time.monotonic() - started)
+        if return_message == "SUCCESS":
+            metrics.inc("uploads")
+            metrics.inc("uploaded_bytes", size)
+            # record before removing local copy, so a crash in between never loses the zip
+            manifest.markUploaded(run["run_id"], range_start, range_end, file_id)
+            os.remove(f"{zip_path}/{file_name}")
+            break
+        metrics.inc("upload_errors")
+        print(f"{bcolors.FAIL} upload {file_name} failed ({attempt + 1}/{attempts}): {return_message} {bcolors.ENDC}")
+        if stop_event.wait(2 ** attempt):
+            break
+    upload_budget.release(size)
+
+"""
+Compare manifest with local zips to find what is left of a run.
+Uploaded ranges are skipped, archived zips that still open are queued for upload,
+partial zips are reopened and only their missing instance ids, failed ones included, are downloaded again.
+An archived zip of a range with failed ids, from before ranges could be partial, is reopened too.
+Anything that cannot be verified is downloaded from scratch.
+@param run, run dictionary from manifest
+@return (instance ids to download, open partial zips, ranges waiting for upload)
+"""
+def planRun(run):
+    to_download = []; open_zips = {}; backlog = []
+    ranges = manifest.ranges(run["run_id"])
+    for range_start in range(run["start_index"], run["end_index"] + 1, run["archive_size"]):
+        range_end = min(range_start + run["archive_size"] - 1, run["end_index"])
+        file_name = f"{zip_path}/{range_start}_{range_end}.zip"
+        status = ranges.get(range_start, (None, None, None))[1]
+        if status == "uploaded":
+            continue
+        if status == "archived" and len(manifest.downloadedIds(run["run_id"], range_start, range_end, "failed")) > 0:
+            if os.path.exists(file_name):
+                os.replace(file_name, f"{file_name}.part")
+        elif status == "archived":
+            try:
+                with zipfile.ZipFile(file_name) as zf:
+                    if zf.testzip() is None:
+                        backlog.append((range_start, range_end))
+                        continue
+            except (OSError, zipfile.BadZipFile):
+                pass
+        done = set()
+        if os.path.exists(f"{file_name}.part"):
+            try:
+                zf = zipfile.ZipFile(f"{file_name}.part", "a", zipfile.ZIP_DEFLATED)
+                if zf.testzip() is not None:
+                    raise zipfile.BadZipFile(f"{file_name}.part corrupted")
+                # zip members are the truth, manifest may lag behind the last commit
+                done = {int(name.replace("assessment_instance_", "").split("_")[0]) for name in zf.namelist()}
+                open_zips[range_start] = [zf, len(done), 0]
+            except (OSError, zipfile.BadZipFile):
+                done = set()
+        if range_start not in open_zips:
+            manifest.resetRange(run["run_id"], range_start, range_end)
+            if os.path.exists(f"{file_name}.part"):
+                os.remove(f"{file_name}.part")
+        to_download += [i for i in range(range_start, range_end + 1) if i not in done]
+    return to_download, open_zips, backlog
+
+
+"""
+@param archive_tid, archiver thread expected to be still running, None once it was sent the sentinel
+@raise RuntimeError if a stage died
+"""
+def checkStages(archive_tid = None):
+    if len(stage_errors) > 0:
+        stage, error = stage_errors[0]
+        raise RuntimeError(f"{stage} stage failed: {error}")
+    if archive_tid is not None and not archive_tid.is_alive():
+        raise RuntimeError("archive stage stopped")
+
 
-    tid = []
-    box_upload_tid = -1
-    prev = start_index
+def main():
+    global zip_path
+    run = manifest.findRun(COURSE_INSTANCE, start_date_str, end_date_str) if resume else None
+    if run is not None:
+        zip_path = run["zip_path"]
+        print(f"\nResume download from {run['start_index']} to {run['end_index']} \u2713", flush = True)
+    else:
+        try:
+            print("\nCalculate search range... ", end = "", flush = True)
+            # get ending range
+            total_log_count = getInstanceRange()
+            # get start and end index of download range
+            start_date = datetime.strptime(start_date_str, "%Y-%m-%d")
+            end_date = datetime.strptime(end_date_str, "%Y-%m-%d")
+            start_index = searchDate(1, total_log_count, start_date)
+            end_index = searchDate(start_index, total_log_count, end_date + timedelta(days = 1)) - 1
+            print(f"from {start_index} to {end_index} \u2713", flush = True)
+            if end_index < start_index:
+                print(f"{bcolors.WARNING} No log file between {start_date_str} and {end_date_str}. {bcolors.ENDC}")
+                exit()
+        except (KeyboardInterrupt, Exception) as e:
+            if type(e) == KeyboardInterrupt:
+                print(f"\n{bcolors.WARNING}KeyboardInterrupt{bcolors.ENDC}")
+            else:
+                print(f"\n{bcolors.FAIL} ERROR: {e} {bcolors.ENDC}")
+            exit()
+        run = manifest.createRun(COURSE_INSTANCE, start_date_str, end_date_str, start_index, end_index,
+                                 archive_size if archive_size > 0 else thread_num * download_batch, os.path.abspath(zip_path))
+    # init directory to store zip file
+    os.makedirs(zip_path, exist_ok = True)
+    start_index = run["start_index"]; end_index = run["end_index"]; run_archive_size = run["archive_size"]
+    to_download, open_zips, backlog = planRun(run)
+
+    stop_event = threading.Event()
+    # bounded queues between stages, a full queue blocks the stage before it
+    # ordered by not before time, so retries backing off wait behind ids that can go now
+    id_queue = queue.PriorityQueue()
+    log_queue = queue.Queue(maxsize = queue_size if queue_size > 0 else thread_num * 4)
+    # zips on disk are bounded by upload_budget instead of queue size
+    upload_queue = queue.Queue()
+    upload_budget = UploadBudget(max_pending_upload_mb * 1024 * 1024)
+    for i in to_download:
+        id_queue.put((0, i, 0))
+    for range_start, range_end in backlog:
+        upload_budget.add(os.path.getsize(f"{zip_path}/{range_start}_{range_end}.zip"))
+        upload_queue.put((range_start, range_end))
+
+    workers = [threading.Thread(target = downloadWorker, args = [id_queue, log_queue, stop_event], daemon = True) for _ in range(thread_num)]
+    archive_tid = threading.Thread(target = archiver, args = [log_queue, upload_queue, stop_event, run, open_zips, upload_budget], daemon = True)
+    upload_tids = [threading.Thread(target = uploader, args = [upload_queue, stop_event, run, upload_budget], daemon = True) for _ in range(upload_workers)]
+    metrics.setGauge("id_queue_depth", id_queue.qsize)
+    metrics.setGauge("log_queue_depth", log_queue.qsize)
+    metrics.setGauge("upload_queue_depth", upload_queue.qsize)
+    metrics.setGauge("pending_upload_bytes", lambda: upload_budget.pending)
+    metrics.setGauge("concurrency_limit", controller.currentLimit)
+    metrics.start(stop_event)
     try:
-        print(f"start downloading {end_index - start_index + 1} log files. Each iteration {thread_num * download_batch} log files.\n")
-        # for each batch of downloading
-        for i in tqdm(range(start_index, end_index + 1, thread_num * download_batch)):
-            # reset tid lists
-            tid.clear()
-            # create n thread, each thread download download_batch log files
-            for _ in range(thread_num):
-                if i > end_index:
+        print(f"start downloading {len(to_download)} of {end_index - start_index + 1} log files with {min_thread_num} - {thread_num} concurrent requests. Each zip {run_archive_size} log files.\n")
+        archive_tid.start()
+        for t in upload_tids:
+            t.start()
+        for t in workers:
+            t.start()
+        # wait for every stage to drain, sentinel tells next stage no more input is coming
+        with tqdm(total = len(to_download)) as progress:
+            while any(t.is_alive() for t in workers):
+                # a dead archiver would leave workers waiting on log_queue forever
+                if len(stage_errors) > 0 or not archive_tid.is_alive():
                     break
-                # create thread, update i, save thread to tid, and start thread
-                thread = threading.Thread(target = getJson, args = [i, min(end_index, i + download_batch - 1)])
-                i += download_batch
-                tid.append(thread)
-                thread.start()
-            # join all thread
-            for t in tid:
-                t.join()
-            # zip all downloaded files in current batch, remove raw files
-            os.system(f"zip -qq -r {zip_path}/{prev}_{i - 1}.zip {store_path}")
-            os.system(f"cd {store_path} && rm -rf assessment_instance_*.json && cd ..")
-            # use another thread to upload zip to box, and remove zip
-            box_upload_tid = threading.Thread(target = upload, args = [zip_path, f"{prev}_{i - 1}.zip", False])
-            box_upload_tid.start()
-            prev = i
-        # wait for last upload to finish
-        box_upload_tid.join()
+                time.sleep(0.5)
+                progress.n = metrics.get("files")
+                progress.set_postfix(files_per_sec = f"{metrics.rate('files'):.1f}", concurrency = controller.currentLimit(), retries = metrics.get("retries"))
+                progress.refresh()
+            progress.n = metrics.get("files")
+            progress.refresh()
+        checkStages(archive_tid)
+        putUntilStopped(log_queue, None, stop_event)
+        waitThread(archive_tid)
+        for t in upload_tids:
+            upload_queue.put(None)
+        for t in upload_tids:
+            waitThread(t)
+        checkStages()
     except (KeyboardInterrupt, Exception) as e:
         print("waiting for all started thread to stop...")
-        for t in tid:
-            t.join()
-        if type(box_upload_tid) != int:
-            box_upload_tid.join()
-        os.system(f"cd {store_path} && rm -rf assessment_instance_*.json && cd ..")
+        stop_event.set()
+        for t in workers + [archive_tid] + upload_tids:
+            if t.is_alive():
+                t.join(timeout = 10)
         if type(e) == KeyboardInterrupt:
             print(f"{bcolors.WARNING}KeyboardInterrupt{bcolors.ENDC}")
         else:
             print(f"{bcolors.FAIL} ERROR: {e} {bcolors.ENDC}")
-        
-        print(f"{bcolors.WARNING} Attempt to download log file {start_index} - {end_index}, last saved log id: {prev} {bcolors.ENDC}")
-    # delete temp directories
-    os.system(f"rm -r {store_path}; rm -r {zip_path}")
+        archived = [(start, end) for start, (end, _, _) in manifest.ranges(run["run_id"]).items()]
+        print(f"{bcolors.WARNING} Attempt to download log file {start_index} - {end_index}, last saved log id: {lastArchivedId(start_index, archived)} {bcolors.ENDC}")
+    manifest.flush()
+    # stops metrics writer too, final snapshot written below
+    stop_event.set()
+    metrics.write()
+    print(metrics.summary())
+    failed = manifest.downloadedIds(run["run_id"], start_index, end_index, "failed")
+    if len(failed) > 0:
+        print(f"{bcolors.WARNING} {len(failed)} log files failed to download, their zips are kept for --resume. {bcolors.ENDC}")
+    # a range with failed ids is not complete on box even if uploaded
+    uploaded = [start for start, (end, status, _) in manifest.ranges(run["run_id"]).items()
+                if status == "uploaded" and not any(start <= i <= end for i in failed)]
+    if len(uploaded) == len(range(start_index, end_index + 1, run_archive_size)):
+        # everything is on box, delete temp directory
+        os.system(f"rm -r {zip_path}")
+    else:
+        print(f"{bcolors.WARNING} {len(uploaded)} of {len(range(start_index, end_index + 1, run_archive_size))} zips uploaded. Run again with --resume to continue, partial zips kept in {zip_path} {bcolors.ENDC}")
 
 
 def sanity_check():
-    thread_flag = True; api_flag = True; date_flag = True; box_flag = True; zip_flag = True
+    thread_flag = True; api_flag = True; date_flag = True; box_flag = True
     print("Sanity Check Initiated.")
     
-    if which("zip") == None:
-        print(f"{bcolors.FAIL} ZIP package not exist on current system. {bcolors.ENDC}")
-        zip_flag = False
     # check download_batch
     if download_batch < 0:
         print(f"{bcolors.FAIL} download_batch MUST be positive. {bcolors.ENDC}")
@@ -266,9 +667,28 @@ def sanity_check():
         if confirm.lower() != 'y':
             thread_flag = False
 
+    if min_thread_num < 1 or min_thread_num > thread_num:
+        print(f"{bcolors.FAIL} min_thread_num MUST be positive and no greater than thread_num. {bcolors.ENDC}")
+        thread_flag = False
+    if archive_size < 0:
+        print(f"{bcolors.FAIL} archive_size MUST be positive. {bcolors.ENDC}")
+        thread_flag = False
+
+    # check columnar output
+    if columnar_path:
+        try:
+            resolveFormat(columnar_format)
+        except (ImportError, ValueError) as e:
+            print(f"{bcolors.FAIL} {e}. {bcolors.ENDC}")
+            thread_flag = False
+
+    # check upload_workers
+    if upload_workers < 1:
+        print(f"{bcolors.FAIL} upload_workers MUST be positive. {bcolors.ENDC}")
+        thread_flag = False
+
     # check api
-    test_url = f"https://www.prairielearn.org/pl/api/v1/course_instances/{COURSE_INSTANCE}/assessment_instances/{1}/log?private_token={API_TOKEN}"
-    response = requests.get(test_url)
+    response = client.send(client.logPath(1))
     test_text = response.text
     if response.status_code != 200:
         api_flag = False
@@ -322,11 +742,6 @@ def sanity_check():
 
 
     # whole check
-    print("\t zip package: \t", end = "")
-    if (zip_flag):
-        print(f"{bcolors.OKGREEN}\t\t\u2713 {bcolors.ENDC}")
-    else:
-        print(f"{bcolors.FAIL}\t\t\u2717 {bcolors.ENDC}")
     print("\t multi-thread download config: \t", end = "")
     if (thread_flag):
         print(f"{bcolors.OKGREEN}\u2713 {bcolors.ENDC}")
@@ -348,7 +763,7 @@ def sanity_check():
     else:
         print(f"{bcolors.FAIL} \t\u2717 {bcolors.ENDC}")
     
-    return thread_flag and api_flag and date_flag and box_flag and zip_flag
+    return thread_flag and api_flag and date_flag and box_flag
             
 
 if __name__ == "__main__":
@@ -356,20 +771,48 @@ if __name__ == "__main__":
     # parse thread config
     download_batch = args.download_batch
     thread_num = args.thread_num
+    min_thread_num = args.min_thread_num
+    archive_size = args.archive_size
+    max_retries = args.max_retries
+    queue_size = args.queue_size
     # parse api info config
     COURSE_INSTANCE = args.course_instance
     API_TOKEN = args.api_token
+    pl_server = args.pl_server.rstrip("/")
     # parse download range
     start_date_str = args.start_date
     end_date_str = args.end_date
     # parse box config
     box_config_path = args.box_config_path
     box_folder_id = args.box_folder_id
+    # parse box upload config
+    upload_workers = args.upload_workers
+    max_pending_upload_mb = args.max_pending_upload_mb
+    # parse columnar output config
+    columnar_path = args.columnar_path
+    columnar_format = args.columnar_format
+    end_run = args.end_run
+    client = PrairieLearnClient(pl_server, COURSE_INSTANCE, API_TOKEN, pool_size = max(thread_num, 2), max_retries = max_retries,
+                                rate_limit = args.rate_limit, rate_burst = args.rate_burst)
+    box_uploader = BoxUploader(box_config_path, box_folder_id, part_workers = args.upload_part_workers)
     # sanity check for input and system packages
     if not sanity_check():
         exit()
-    # generate random temp path to store file
-    store_path = str(uuid.uuid4())
-    zip_path = str(uuid.uuid4())
+    # generate random temp path to store file unless given
+    zip_path = args.zip_path if args.zip_path else str(uuid.uuid4())
+    # open download progress manifest
+    manifest_path = args.manifest_path
+    resume = args.resume
+    manifest = DownloadManifest(manifest_path)
+    # open local index of probed instances
+    index_path = args.index_path
+    instance_index = InstanceIndex(index_path, COURSE_INSTANCE)
+    # columnar copy of logs for analysis, zips stay the format uploaded to box
+    if columnar_path:
+        log_store = ColumnarLogStore(columnar_path, columnar_format)
+    probe_pool = ThreadPoolExecutor(max_workers = max(thread_num, 2))
+    # adaptive number of requests in flight, workers beyond current limit wait
+    controller = AdaptiveConcurrency(min_thread_num, thread_num)
+    metrics = Metrics(args.metrics_path, args.metrics_interval)
     # start main program
     main()
@@ -0,0 +1,60 @@
+import sqlite3
+import threading
+import time
+
+"""
+Persistent local index of probed assessment instances.
+Maps (course_instance, instance_id) to the date of the first log event, or to
+empty when the instance has no log. First event dates never change, so they are
+reused forever. Empty results are only trusted for empty_ttl seconds because new
+instances keep being created at the end of the id range.
+"""
+class InstanceIndex:
+    """
+    @param path, sqlite database file
+    @param course_instance, course instance id the probes belong to
+    @param empty_ttl, seconds an empty probe result stays valid
+    """
+    def __init__(self, path, course_instance, empty_ttl = 24 * 3600):
+        self.course_instance = course_instance
+        self.empty_ttl = empty_ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread = False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS instance_probe (
+                                course_instance INTEGER NOT NULL,
+                                instance_id INTEGER NOT NULL,
+                                first_date TEXT,
+                                probed_at REAL NOT NULL,
+                                PRIMARY KEY (course_instance, instance_id))""")
+        self.conn.commit()
+
+    """
+    Look up a probe result.
+    @param instance_id, assessment instance id
+    @return (found, first_date) where first_date is "YYYY-MM-DD" or None for empty instance
+    """
+    def lookup(self, instance_id):
+        with self.lock:
+            row = self.conn.execute("SELECT first_date, probed_at FROM instance_probe WHERE course_instance = ? AND instance_id = ?",
+                                    (self.course_instance, instance_id)).fetchone()
+        if row is None:
+            return False, None
+        first_date, probed_at = row
+        if first_date is None and time.time() - probed_at > self.empty_ttl:
+            return False, None
+        return True, first_date
+
+    """
+    Record a probe result.
+    @param instance_id, assessment instance id
+    @param first_date, "YYYY-MM-DD" of the first log event, None if instance has no log
+    """
+    def record(self, instance_id, first_date):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO instance_probe VALUES (?, ?, ?, ?)",
+                              (self.course_instance, instance_id, first_date, time.time()))
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
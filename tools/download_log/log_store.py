@@ -0,0 +1,184 @@
+import gzip
+import json
+import os
+import threading
+import zipfile
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None; pq = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# top level event fields stored as their own column, everything else goes to extra as json
+COLUMNS = ["assessment_instance_id", "event_date", "event_name", "user_uid", "qid",
+           "instance_question_id", "variant_id", "submission_id", "data", "extra"]
+INT_COLUMNS = {"assessment_instance_id", "instance_question_id", "variant_id", "submission_id"}
+FORMATS = {"parquet": ".parquet", "jsonl.zst": ".jsonl.zst", "jsonl.gz": ".jsonl.gz"}
+
+"""
+Pick the best shard format available on this system.
+@param fmt, "auto" or one of FORMATS
+@return format name
+"""
+def resolveFormat(fmt):
+    if fmt == "auto":
+        if pa is not None:
+            return "parquet"
+        return "jsonl.zst" if zstandard is not None else "jsonl.gz"
+    if fmt == "parquet" and pa is None:
+        raise ImportError("parquet output needs pyarrow, pip install pyarrow")
+    if fmt == "jsonl.zst" and zstandard is None:
+        raise ImportError("jsonl.zst output needs zstandard, pip install zstandard")
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown columnar format {fmt}, expect auto, {', '.join(FORMATS)}")
+    return fmt
+
+"""
+Flatten one log event to a row of COLUMNS.
+"""
+def eventRow(instance_id, event):
+    row = {"assessment_instance_id": instance_id}
+    extra = {}
+    for key, value in event.items():
+        if key in COLUMNS and key not in ("assessment_instance_id", "data", "extra"):
+            row[key] = value
+        elif key != "data":
+            extra[key] = value
+    if "data" in event:
+        row["data"] = None if event["data"] is None else json.dumps(event["data"])
+    row["extra"] = json.dumps(extra) if len(extra) > 0 else None
+    for key in INT_COLUMNS:
+        if row.get(key) is not None:
+            row[key] = int(row[key])
+    return row
+
+"""
+Writer of one shard. Rows are buffered and flushed in batches, so memory stays
+bounded by batch_rows no matter how large the range is.
+"""
+class ShardWriter:
+    def __init__(self, path, fmt, batch_rows):
+        self.path = path
+        self.fmt = fmt
+        self.batch_rows = batch_rows
+        self.rows = []
+        self.count = 0
+        self.min_instance_id = None
+        self.max_instance_id = None
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        if fmt == "parquet":
+            self.schema = pa.schema([(c, pa.int64() if c in INT_COLUMNS else pa.string()) for c in COLUMNS])
+            self.writer = pq.ParquetWriter(f"{path}.part", self.schema, compression = "zstd")
+        elif fmt == "jsonl.zst":
+            self.raw = open(f"{path}.part", "wb")
+            self.writer = zstandard.ZstdCompressor(level = 3).stream_writer(self.raw)
+        else:
+            self.writer = gzip.open(f"{path}.part", "wb")
+
+    def add(self, row):
+        self.rows.append(row)
+        self.count += 1
+        instance_id = row["assessment_instance_id"]
+        self.min_instance_id = instance_id if self.min_instance_id is None else min(self.min_instance_id, instance_id)
+        self.max_instance_id = instance_id if self.max_instance_id is None else max(self.max_instance_id, instance_id)
+        if len(self.rows) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if len(self.rows) == 0:
+            return
+        if self.fmt == "parquet":
+            self.writer.write_table(pa.Table.from_pylist([{c: row.get(c) for c in COLUMNS} for row in self.rows], schema = self.schema))
+        else:
+            self.writer.write(b"".join(json.dumps({c: row.get(c) for c in COLUMNS}).encode() + b"\n" for row in self.rows))
+        self.rows.clear()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        if self.fmt == "jsonl.zst":
+            self.raw.close()
+        os.replace(f"{self.path}.part", self.path)
+
+
+"""
+Local store of assessment instance logs as compressed columnar shards, one row per event.
+Shards are partitioned by event date and by {start}_{end} instance id range:
+    {root}/event_date=YYYY-MM-DD/{start}_{end}.parquet
+and listed in {root}/manifest.json with their row count and instance id bounds, so an
+analysis reads only the dates, ranges and columns it needs.
+"""
+class ColumnarLogStore:
+    """
+    @param root, store directory
+    @param fmt, "auto", "parquet", "jsonl.zst" or "jsonl.gz"
+    @param batch_rows, rows buffered per shard before they are written out
+    """
+    def __init__(self, root, fmt = "auto", batch_rows = 10000):
+        self.root = root
+        self.fmt = resolveFormat(fmt)
+        self.batch_rows = batch_rows
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok = True)
+        self.manifest_path = os.path.join(root, "manifest.json")
+        self.manifest = {"format": self.fmt, "columns": COLUMNS, "shards": []}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+
+    def hasRange(self, range_start, range_end):
+        with self.lock:
+            return any(s["range_start"] == range_start and s["range_end"] == range_end for s in self.manifest["shards"]) or \
+                   [range_start, range_end] in self.manifest.get("empty_ranges", [])
+
+    """
+    Write every event of a range into its date partitions.
+    @param logs, iterable of (instance_id, list of events)
+    """
+    def writeRange(self, range_start, range_end, logs):
+        writers = {}
+        try:
+            for instance_id, events in logs:
+                for event in events:
+                    date = str(event.get("event_date") or "unknown")[0:10]
+                    if date not in writers:
+                        path = os.path.join(self.root, f"event_date={date}", f"{range_start}_{range_end}{FORMATS[self.fmt]}")
+                        writers[date] = ShardWriter(path, self.fmt, self.batch_rows)
+                    writers[date].add(eventRow(instance_id, event))
+        except Exception:
+            for writer in writers.values():
+                writer.writer.close()
+            raise
+        shards = []
+        for date, writer in sorted(writers.items()):
+            writer.close()
+            shards.append({"path": os.path.relpath(writer.path, self.root), "event_date": date,
+                           "range_start": range_start, "range_end": range_end, "rows": writer.count,
+                           "min_instance_id": writer.min_instance_id, "max_instance_id": writer.max_instance_id})
+        with self.lock:
+            self.manifest["shards"] = [s for s in self.manifest["shards"] if not (s["range_start"] == range_start and s["range_end"] == range_end)] + shards
+            if len(shards) == 0:
+                self.manifest.setdefault("empty_ranges", []).append([range_start, range_end])
+            with open(f"{self.manifest_path}.tmp", "w") as f:
+                json.dump(self.manifest, f, indent = 1)
+            os.replace(f"{self.manifest_path}.tmp", self.manifest_path)
+
+    """
+    Write a range from its finished {start}_{end}.zip.
+    """
+    def writeRangeFromZip(self, range_start, range_end, zip_file):
+        def logs():
+            with zipfile.ZipFile(zip_file) as zf:
+                for name in zf.namelist():
+                    instance_id = int(os.path.basename(name).replace("assessment_instance_", "").split("_")[0])
+                    with zf.open(name) as f:
+                        events = json.load(f)
+                    if isinstance(events, list):
+                        yield instance_id, events
+        self.writeRange(range_start, range_end, logs())
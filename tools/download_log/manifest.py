@@ -0,0 +1,148 @@
+import sqlite3
+import threading
+import time
+
+"""
+Durable checkpoint of a download run.
+Records which instance ids were downloaded, which {start}_{end} ranges were
+archived and which archives were confirmed on box, so an interrupted run can
+continue from the exact gap instead of starting over.
+"""
+class DownloadManifest:
+    """
+    @param path, sqlite database file
+    @param flush_every, number of downloaded instance ids buffered before commit
+    """
+    def __init__(self, path, flush_every = 200):
+        self.flush_every = flush_every
+        self.pending = []
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread = False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS run (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                course_instance INTEGER NOT NULL,
+                start_date TEXT NOT NULL,
+                end_date TEXT NOT NULL,
+                start_index INTEGER NOT NULL,
+                end_index INTEGER NOT NULL,
+                archive_size INTEGER NOT NULL,
+                zip_path TEXT NOT NULL,
+                created_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS instance (
+                run_id INTEGER NOT NULL,
+                instance_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                PRIMARY KEY (run_id, instance_id));
+            CREATE TABLE IF NOT EXISTS archive (
+                run_id INTEGER NOT NULL,
+                range_start INTEGER NOT NULL,
+                range_end INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                box_file_id TEXT,
+                PRIMARY KEY (run_id, range_start));""")
+        self.conn.commit()
+
+    """
+    Find latest run downloading the same course instance and dates.
+    @return dictionary of run columns, None if no such run
+    """
+    def findRun(self, course_instance, start_date, end_date):
+        with self.lock:
+            cursor = self.conn.execute("""SELECT * FROM run WHERE course_instance = ? AND start_date = ? AND end_date = ?
+                                          ORDER BY run_id DESC LIMIT 1""", (course_instance, start_date, end_date))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip([c[0] for c in cursor.description], row))
+
+    """
+    Start a new run.
+    @return run dictionary
+    """
+    def createRun(self, course_instance, start_date, end_date, start_index, end_index, archive_size, zip_path):
+        with self.lock:
+            cursor = self.conn.execute("""INSERT INTO run (course_instance, start_date, end_date, start_index, end_index, archive_size, zip_path, created_at)
+                                          VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                                       (course_instance, start_date, end_date, start_index, end_index, archive_size, zip_path, time.time()))
+            self.conn.commit()
+            run_id = cursor.lastrowid
+        return self.findRunById(run_id)
+
+    def findRunById(self, run_id):
+        with self.lock:
+            cursor = self.conn.execute("SELECT * FROM run WHERE run_id = ?", (run_id,))
+            return dict(zip([c[0] for c in cursor.description], cursor.fetchone()))
+
+    """
+    Record a downloaded instance. Buffered, committed every flush_every ids or on flush().
+    @param ok, False if download failed and the instance is missing from its archive
+    """
+    def markDownloaded(self, run_id, instance_id, ok = True):
+        with self.lock:
+            self.pending.append((run_id, instance_id, "ok" if ok else "failed"))
+            if len(self.pending) >= self.flush_every:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if len(self.pending) > 0:
+            self.conn.executemany("INSERT OR REPLACE INTO instance VALUES (?, ?, ?)", self.pending)
+            self.pending.clear()
+        self.conn.commit()
+
+    """
+    @return set of instance ids in [range_start, range_end] downloaded with given status
+    """
+    def downloadedIds(self, run_id, range_start, range_end, status = "ok"):
+        with self.lock:
+            self._flush()
+            rows = self.conn.execute("SELECT instance_id FROM instance WHERE run_id = ? AND instance_id BETWEEN ? AND ? AND status = ?",
+                                     (run_id, range_start, range_end, status)).fetchall()
+        return {row[0] for row in rows}
+
+    def markArchived(self, run_id, range_start, range_end):
+        with self.lock:
+            self._flush()
+            self.conn.execute("INSERT OR REPLACE INTO archive VALUES (?, ?, ?, 'archived', NULL)", (run_id, range_start, range_end))
+            self.conn.commit()
+
+    """
+    Range whose ids were all tried but some failed, its {start}_{end}.zip.part is kept for --resume to fill in.
+    """
+    def markPartial(self, run_id, range_start, range_end):
+        with self.lock:
+            self._flush()
+            self.conn.execute("INSERT OR REPLACE INTO archive VALUES (?, ?, ?, 'partial', NULL)", (run_id, range_start, range_end))
+            self.conn.commit()
+
+    def markUploaded(self, run_id, range_start, range_end, box_file_id):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO archive VALUES (?, ?, ?, 'uploaded', ?)", (run_id, range_start, range_end, str(box_file_id)))
+            self.conn.commit()
+
+    """
+    Forget everything recorded for a range, used when its local archive is lost or corrupted.
+    """
+    def resetRange(self, run_id, range_start, range_end):
+        with self.lock:
+            self._flush()
+            self.conn.execute("DELETE FROM archive WHERE run_id = ? AND range_start = ?", (run_id, range_start))
+            self.conn.execute("DELETE FROM instance WHERE run_id = ? AND instance_id BETWEEN ? AND ?", (run_id, range_start, range_end))
+            self.conn.commit()
+
+    """
+    @return dictionary key = range_start, value = (range_end, status, box_file_id)
+    """
+    def ranges(self, run_id):
+        with self.lock:
+            rows = self.conn.execute("SELECT range_start, range_end, status, box_file_id FROM archive WHERE run_id = ?", (run_id,)).fetchall()
+        return {row[0]: (row[1], row[2], row[3]) for row in rows}
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.conn.close()
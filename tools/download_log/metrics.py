@@ -0,0 +1,166 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+"""
+Counters, latency histogram, gauges and per stage time of a download run.
+Snapshot is rewritten to path every interval seconds, as Prometheus text if path
+ends with .prom and as JSON otherwise, so a run can be watched while it goes.
+"""
+class Metrics:
+    """
+    @param path, file periodically rewritten with snapshot, "" to disable
+    @param interval, seconds between rewrites
+    """
+    def __init__(self, path = "", interval = 10):
+        self.path = path
+        self.interval = interval
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.status = {}
+        self.stage_seconds = {}
+        self.gauges = {}
+        self.latency_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.thread = None
+
+    """
+    Record a finished http request.
+    @param latency, seconds
+    @param status, http status code, None if request raised
+    @param size, bytes of response body
+    """
+    def observeRequest(self, latency, status, size = 0):
+        with self.lock:
+            key = "error" if status is None else str(status)
+            self.status[key] = self.status.get(key, 0) + 1
+            self.latency_counts[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+            self.latency_sum += latency
+            self.counters["requests"] = self.counters.get("requests", 0) + 1
+            self.counters["bytes"] = self.counters.get("bytes", 0) + size
+
+    def inc(self, name, value = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def get(self, name):
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    """
+    Add time spent in a stage, or blocked waiting on the next one.
+    """
+    def addTime(self, stage, seconds):
+        with self.lock:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+    """
+    Register a gauge sampled on every snapshot.
+    @param fn, callable returning current value
+    """
+    def setGauge(self, name, fn):
+        with self.lock:
+            self.gauges[name] = fn
+
+    def rate(self, name):
+        return self.get(name) / max(time.time() - self.started, 1e-9)
+
+    """
+    Approximate latency quantile from histogram, upper bound of the bucket it falls in.
+    """
+    def latencyQuantile(self, q):
+        total = sum(self.latency_counts)
+        if total == 0:
+            return 0.0
+        seen = 0
+        for i, count in enumerate(self.latency_counts):
+            seen += count
+            if seen >= q * total:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float("inf")
+        return float("inf")
+
+    def snapshot(self):
+        gauges = {}
+        for name, fn in list(self.gauges.items()):
+            try:
+                gauges[name] = fn()
+            except Exception:
+                gauges[name] = None
+        with self.lock:
+            elapsed = max(time.time() - self.started, 1e-9)
+            return {"elapsed_seconds": elapsed,
+                    "counters": dict(self.counters),
+                    "per_second": {name: value / elapsed for name, value in self.counters.items()},
+                    "requests_by_status": dict(self.status),
+                    "latency_seconds": {"buckets": dict(zip([str(b) for b in LATENCY_BUCKETS] + ["+Inf"], self.latency_counts)),
+                                        "sum": self.latency_sum,
+                                        "count": sum(self.latency_counts),
+                                        "p50": self.latencyQuantile(0.5),
+                                        "p95": self.latencyQuantile(0.95)},
+                    "stage_seconds": dict(self.stage_seconds),
+                    "gauges": gauges}
+
+    """
+    Render snapshot as Prometheus text exposition format.
+    """
+    def prometheus(self, snap):
+        lines = [f"pl_download_elapsed_seconds {snap['elapsed_seconds']}"]
+        for name, value in snap["counters"].items():
+            lines.append(f"pl_download_{name}_total {value}")
+        for status, value in snap["requests_by_status"].items():
+            lines.append(f'pl_download_requests_by_status_total{{status="{status}"}} {value}')
+        cumulative = 0
+        for le, count in snap["latency_seconds"]["buckets"].items():
+            cumulative += count
+            lines.append(f'pl_download_request_duration_seconds_bucket{{le="{le}"}} {cumulative}')
+        lines.append(f"pl_download_request_duration_seconds_sum {snap['latency_seconds']['sum']}")
+        lines.append(f"pl_download_request_duration_seconds_count {snap['latency_seconds']['count']}")
+        for stage, value in snap["stage_seconds"].items():
+            lines.append(f'pl_download_stage_seconds_total{{stage="{stage}"}} {value}')
+        for name, value in snap["gauges"].items():
+            if value is not None:
+                lines.append(f"pl_download_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    """
+    Rewrite metrics file with current snapshot, through a temp file so readers never see half of it.
+    """
+    def write(self):
+        if self.path == "":
+            return
+        snap = self.snapshot()
+        with open(f"{self.path}.tmp", "w") as f:
+            if self.path.endswith(".prom"):
+                f.write(self.prometheus(snap))
+            else:
+                json.dump(snap, f, indent = 2)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    """
+    Start background thread rewriting metrics file until stop_event is set.
+    """
+    def start(self, stop_event):
+        def loop():
+            while not stop_event.wait(self.interval):
+                self.write()
+        self.thread = threading.Thread(target = loop, daemon = True)
+        self.thread.start()
+
+    """
+    @return human readable summary of the run
+    """
+    def summary(self):
+        snap = self.snapshot()
+        counters = snap["counters"]; elapsed = snap["elapsed_seconds"]
+        lines = [f"downloaded {counters.get('files', 0)} log files ({counters.get('bytes', 0) / 1e6:.1f} MB) in {elapsed:.1f}s, "
+                 f"{counters.get('files', 0) / elapsed:.1f} log files/s, {counters.get('bytes', 0) / 1e6 / elapsed:.2f} MB/s",
+                 f"requests: {counters.get('requests', 0)} ({counters.get('requests', 0) / elapsed:.1f}/s), "
+                 f"retries: {counters.get('retries', 0)}, by status: {snap['requests_by_status']}",
+                 f"request latency p50 <= {snap['latency_seconds']['p50']}s, p95 <= {snap['latency_seconds']['p95']}s",
+                 "stage seconds: " + ", ".join(f"{stage} {value:.1f}" for stage, value in sorted(snap["stage_seconds"].items()))]
+        return "\n".join(lines)
@@ -0,0 +1,90 @@
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TEST_DIR)
+# fake boxsdk of the benchmark stands in when the real one is not installed, getInstanceRange never calls box
+try:
+    import boxsdk
+except ImportError:
+    sys.path.insert(0, os.path.join(TEST_DIR, "..", "benchmark", "fake_box"))
+import download
+import requests
+from concurrency import AdaptiveConcurrency
+from metrics import Metrics
+
+
+"""
+Course with instance ids 1..last, a fraction of them without log, probed through a stub getTimes.
+"""
+def fakeCourse(monkeypatch, last, empty_rate, seed, thread_num = 16):
+    rng = random.Random(seed)
+    has_log = {i for i in range(1, last + 1) if rng.random() >= empty_rate}
+    # the last instance always has a log, so the range end is well defined
+    has_log.add(last)
+    monkeypatch.setattr(download, "thread_num", thread_num)
+    monkeypatch.setattr(download, "end_run", 16)
+    monkeypatch.setattr(download, "getTimes", lambda ids: {i: datetime(2024, 1, 1) if i in has_log else None for i in ids})
+    return has_log
+
+
+@pytest.mark.parametrize("last", [500, 999, 1000, 1001, 20000])
+@pytest.mark.parametrize("seed", range(5))
+def test_instance_range_skips_empty_ids_inside_range(monkeypatch, last, seed):
+    fakeCourse(monkeypatch, last, 0.05, seed)
+    assert download.getInstanceRange() == last
+
+
+def test_instance_range_with_gap_shorter_than_end_run(monkeypatch):
+    has_log = fakeCourse(monkeypatch, 3000, 0, 0)
+    has_log.difference_update(range(1500, 1515))
+    assert download.getInstanceRange() == 3000
+
+
+@pytest.mark.parametrize("thread_num", [1, 2, 5, 32])
+def test_instance_range_thread_num(monkeypatch, thread_num):
+    fakeCourse(monkeypatch, 4321, 0.1, 7, thread_num)
+    assert download.getInstanceRange() == 4321
+
+
+class FlakyClient:
+    """
+    Raises ConnectionError for every request sent in the first down_seconds, then answers 200.
+    """
+    def __init__(self, down_seconds):
+        self.up_at = time.monotonic() + down_seconds
+
+    def logPath(self, instance_id):
+        return f"/assessment_instances/{instance_id}/log"
+
+    def send(self, path, stream = False, stop_event = None):
+        if time.monotonic() < self.up_at:
+            raise requests.ConnectionError("connection refused")
+        return SimpleNamespace(status_code = 200, content = b"[]", headers = {})
+
+
+def test_retries_back_off_until_server_recovers(monkeypatch):
+    monkeypatch.setattr(download, "client", FlakyClient(1.0))
+    monkeypatch.setattr(download, "controller", AdaptiveConcurrency(2, 4))
+    monkeypatch.setattr(download, "metrics", Metrics())
+    monkeypatch.setattr(download, "max_retries", 5)
+    id_queue = queue.PriorityQueue(); log_queue = queue.Queue()
+    for i in range(20):
+        id_queue.put((0, i, 0))
+    stop_event = threading.Event()
+    workers = [threading.Thread(target = download.downloadWorker, args = [id_queue, log_queue, stop_event]) for _ in range(4)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join(timeout = 30)
+    results = [log_queue.get_nowait() for _ in range(log_queue.qsize())]
+    assert sorted(i for i, _ in results) == list(range(20))
+    assert all(body is not None for _, body in results)
@@ -0,0 +1,155 @@
+import bisect
+import json
+import os
+import time
+from datetime import datetime
+
+"""
+Local cache of a box folder listing, refreshed incrementally.
+A refresh pages through the folder newest modified first and stops at the first item older than
+the newest one already cached, so new and re-uploaded archives are picked up without listing the folder.
+Only a full listing sees deletions, it runs when there is no cache or the last one is full_refresh_age old.
+Within max_age seconds of the last refresh the cache is used without calling box.
+"""
+class BoxFolderListing:
+    FIELDS = ["name", "size", "sha1", "modified_at"]
+
+    """
+    @param client, boxsdk Client
+    @param folder_id, box folder id
+    @param cache_path, json file keeping the listing between runs
+    @param max_age, seconds a cached listing is used as is, 0 to refresh every run
+    @param full_refresh_age, seconds after which the whole folder is listed again
+    @param page_size, items per box api page
+    """
+    def __init__(self, client, folder_id, cache_path, max_age = 0, full_refresh_age = 86400, page_size = 1000):
+        self.client = client
+        self.folder_id = str(folder_id)
+        self.cache_path = cache_path
+        self.max_age = max_age
+        self.full_refresh_age = full_refresh_age
+        self.page_size = page_size
+
+    def loadCache(self):
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+            if cache.get("folder_id") == self.folder_id and "full_refreshed_at" in cache:
+                cache["items"] = {int(k): v for k, v in cache["items"].items()}
+                return cache
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def saveCache(self, cache):
+        if not self.cache_path:
+            return
+        with open(f"{self.cache_path}.tmp", "w") as f:
+            json.dump(cache, f)
+        os.replace(f"{self.cache_path}.tmp", self.cache_path)
+
+    def listAll(self):
+        items = {}
+        # get_items pages lazily, marker paging keeps large folders consistent while listing
+        for item in self.client.folder(folder_id = self.folder_id).get_items(limit = self.page_size, use_marker = True, fields = self.FIELDS):
+            items[int(item.id)] = itemMeta(item)
+        return items
+
+    """
+    @param newest, modified_at of the newest cached item
+    @return dictionary of items modified at or after newest
+    """
+    def listModifiedSince(self, newest):
+        items = {}
+        since = parseModifiedAt(newest)
+        for item in self.client.folder(folder_id = self.folder_id).get_items(limit = self.page_size, sort = "date", direction = "DESC", fields = self.FIELDS):
+            meta = itemMeta(item)
+            if since is not None and meta["modified_at"] is not None and parseModifiedAt(meta["modified_at"]) < since:
+                break
+            items[int(item.id)] = meta
+        return items
+
+    """
+    @return dictionary key = item id.astype(int), value = {"name", "size", "sha1", "modified_at"}
+    """
+    def items(self):
+        now = time.time()
+        cache = self.loadCache()
+        if cache is not None and self.max_age > 0 and now - cache["refreshed_at"] < self.max_age:
+            return cache["items"]
+        if cache is None or now - cache["full_refreshed_at"] >= self.full_refresh_age or cache["newest_modified"] is None:
+            cache = {"folder_id": self.folder_id, "full_refreshed_at": now, "items": self.listAll()}
+        else:
+            cache["items"].update(self.listModifiedSince(cache["newest_modified"]))
+        cache["refreshed_at"] = now
+        modified = [m["modified_at"] for m in cache["items"].values() if m["modified_at"] is not None]
+        cache["newest_modified"] = max(modified, key = parseModifiedAt) if modified else None
+        self.saveCache(cache)
+        return cache["items"]
+
+
+def itemMeta(item):
+    return {"name": item.name, "size": getattr(item, "size", None), "sha1": getattr(item, "sha1", None),
+            "modified_at": getattr(item, "modified_at", None)}
+
+"""
+@param value, box modified_at, e.g. 2024-01-01T10:00:00-08:00
+@return aware datetime, None if value is None
+"""
+def parseModifiedAt(value):
+    return None if value is None else datetime.fromisoformat(value)
+
+
+"""
+@param name, {start}_{end}.zip
+@return (start, end) instance ids, None if name does not follow the pattern
+"""
+def parseArchiveName(name):
+    if not name.endswith(".zip"):
+        return None
+    parts = name[:-len(".zip")].split("_")
+    if len(parts) != 2 or not parts[0].isdigit() or not parts[1].isdigit():
+        return None
+    return int(parts[0]), int(parts[1])
+
+
+"""
+Interval index over [start, end] instance id ranges of {start}_{end}.zip archives.
+Archives are sorted by start with a running max of ends, so a lookup is a binary search
+plus a backwards scan that stops as soon as no earlier archive can reach the id.
+"""
+class ArchiveIntervalIndex:
+    """
+    @param box_items, dictionary key = item id, value = archive name, other names are ignored
+    """
+    def __init__(self, box_items):
+        archives = []
+        for file_id, name in box_items.items():
+            bounds = parseArchiveName(name)
+            if bounds is not None:
+                archives.append((bounds[0], bounds[1], file_id, name))
+        archives.sort()
+        self.archives = archives
+        self.starts = [a[0] for a in archives]
+        self.max_ends = []
+        for a in archives:
+            self.max_ends.append(max(a[1], self.max_ends[-1]) if self.max_ends else a[1])
+
+    """
+    @return list of (start, end, file_id, name) of archives overlapping [low, high], by start
+    """
+    def overlapping(self, low, high):
+        i = bisect.bisect_right(self.starts, high) - 1
+        found = []
+        while i >= 0 and self.max_ends[i] >= low:
+            if self.archives[i][1] >= low:
+                found.append(self.archives[i])
+            i -= 1
+        return found[::-1]
+
+    """
+    @return (start, end, file_id, name) of the archive holding instance_id, None if no archive does
+    """
+    def find(self, instance_id):
+        found = self.overlapping(instance_id, instance_id)
+        return found[-1] if found else None
@@ -0,0 +1,80 @@
+import io
+import json
+import re
+
+"""
+Selective reader of assessment_instance logs, a json list of events.
+Only submission_id of each event is kept. A log larger than STREAM_THRESHOLD is streamed:
+the rest of each event, including its data payload, is parsed and dropped, so memory stays
+at one event no matter how large the log is. ijson with its C backend streams when installed,
+otherwise events are decoded one at a time with the stdlib decoder over a growing read buffer.
+Smaller logs are parsed whole, with orjson when installed, which is faster and bounded by the threshold.
+"""
+
+try:
+    import ijson
+    try:
+        ijson = ijson.get_backend("yajl2_c")
+    except (ImportError, ValueError):
+        pass
+    STREAM_PARSER = f"ijson {ijson.backend}"
+except ImportError:
+    ijson = None
+    STREAM_PARSER = "json"
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+STREAM_THRESHOLD = 1 << 20
+DECODER = json.JSONDecoder()
+SEPARATOR = re.compile(r"[\s,]*")
+
+
+"""
+Decode a json list one item at a time.
+@param f, binary file object positioned at the list
+@param chunk_size, characters read at a time, doubled while one item does not fit
+@return iterator of decoded items
+"""
+def iterItems(f, chunk_size:int = 1 << 16):
+    text = io.TextIOWrapper(f, encoding = "utf-8")
+    buffer = text.read(chunk_size).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("log is not a json list")
+    pos = 1; need = chunk_size; eof = False
+    while True:
+        pos = SEPARATOR.match(buffer, pos).end()
+        if pos < len(buffer) and buffer[pos] == "]":
+            return
+        item = None
+        if pos < len(buffer):
+            try:
+                item, end = DECODER.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            # an item ending right at the buffer end may be cut, e.g. a number, read on to be sure
+            if item is not None and (end < len(buffer) or eof):
+                yield item
+                pos = end; need = chunk_size
+                continue
+        if eof:
+            raise ValueError("log ends before closing ]")
+        more = text.read(need)
+        eof = not more
+        buffer = buffer[pos:] + more; pos = 0
+        need *= 2
+
+"""
+@param f, binary file object of an assessment_instance log
+@param size, uncompressed size of the log, streamed if unknown or above STREAM_THRESHOLD
+@return iterator of submission_id of every event, None included
+"""
+def iterSubmissionIds(f, size:int = None):
+    if size is not None and size <= STREAM_THRESHOLD:
+        return (event.get("submission_id") for event in loads(f.read()))
+    if ijson is not None:
+        return ijson.items(f, "item.submission_id")
+    return (event.get("submission_id") for event in iterItems(f))
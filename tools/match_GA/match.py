@@ -1,10 +1,25 @@
 from boxsdk import JWTAuth, Client, exception
 import os
-import json, uuid
+import json
+import zipfile
 from tqdm import tqdm
 import threading
 import pandas as pd
+import numpy as np
 import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+import hashlib
+from match_index import InstanceMatchIndex, InstanceSubmissions
+from box_listing import BoxFolderListing, ArchiveIntervalIndex
+from log_stream import iterSubmissionIds
+from result_writer import ResultWriter, JsonWriter, FORMATS, RESULT_COLUMNS
+
+try:
+    import pyarrow
+    CSV_ENGINE = "pyarrow"
+except ImportError:
+    CSV_ENGINE = "c"
 
 
 class bcolors:
@@ -23,178 +38,380 @@ parser.add_argument("--box_config_path", help="box configuration json file path"
 parser.add_argument("--box_folder_id", help="box configuration json file path", type = int)
 parser.add_argument("--data_dir", help="path to store downloaded zip file", type = str, default = "data")
 parser.add_argument("--all_submission_dir", help="path containing all_submission_csvs", type = str)
-parser.add_argument("--result_dir", help="path to store matching result json", type = str, default = "result.json")
-parser.add_argument("--save_instance_match_dir", help="path to store instance-submission matching result json", type = str, default = "instance_submission_match.json")
+parser.add_argument("--result_dir", help="path to store matching result json, a directory if --shard_by_file", type = str, default = "result.json")
+parser.add_argument("--result_format", help="format of matching result", choices = list(FORMATS), default = "json")
+parser.add_argument("--shard_by_file", help="write one result file per all_submissions csv into result_dir", action = "store_true")
+parser.add_argument("--result_batch_rows", help="result rows converted and written at a time", type = int, default = 100000)
+parser.add_argument("--match_index_path", help="sqlite index of instance-submission matches and processed zips, reused by later runs", type = str, default = "instance_submission_match.sqlite")
+parser.add_argument("--save_instance_match_dir", help="path to also export instance-submission matching result json, not exported if empty", type = str, default = "")
 parser.add_argument("--load_instance_match_dir", help="path to load instance-submission matching result json", type = str, default = "instance_submission_match.json")
 parser.add_argument("--starting_instance_id", help="starting instance id", type = int, default = 1)
+parser.add_argument("--ending_instance_id", help="last instance id, only zips overlapping starting..ending are used, 0 for no limit", type = int, default = 0)
+parser.add_argument("--box_listing_cache", help="json file caching the box folder listing", type = str, default = "box_listing.json")
+parser.add_argument("--box_listing_max_age", help="seconds the cached box listing is used without asking box, 0 to refresh it incrementally every run", type = float, default = 0)
+parser.add_argument("--box_listing_full_refresh", help="seconds after which the whole box folder is listed again to drop deleted items", type = float, default = 86400)
+parser.add_argument("--download_workers", help="zips downloading from box at once", type = int, default = 4)
+parser.add_argument("--csv_workers", help="processes parsing all_submission csvs, 0 for one per core", type = int, default = 0)
+parser.add_argument("--extract_workers", help="processes extracting submissions from zips, 0 for one per core, 1 to extract in this process", type = int, default = 0)
 
 
 box_config_path = ""; config = None; client = None
 data_dir = ""; all_submission_dir = ""; result_dir = ""
 save_instance_match_dir = ""; load_instance_match_dir = ""
 starting_instance_id = 1; box_folder_id = ""
+csv_workers = 0; extract_workers = 0; match_index_path = ""
+download_workers = 4; box_item_meta = {}
+ending_instance_id = 0; box_listing_cache = ""; box_listing_max_age = 0; box_listing_full_refresh = 86400
+result_format = "json"; shard_by_file = False; result_batch_rows = 100000
+worker_existed_id = set()
 
 """
-Get items in box folder.
+Get items in box folder, from the local listing cache while it is fresh.
+Size and sha1 of every item are kept in box_item_meta for fetchZip to verify local copies.
 @param folder_id, box folder id
 @return dictionary key = item.id.astype(int), value = item.name.astype(str)
 """
 def getFolderItems(folder_id):
     try:
-        items =  client.folder(folder_id=folder_id).get_items(limit=5000)
+        items = BoxFolderListing(client, folder_id, box_listing_cache, box_listing_max_age, box_listing_full_refresh).items()
         dic = {}
-        for item in items:
-            dic[int(item.id)] = item.name
+        for file_id, meta in items.items():
+            dic[file_id] = meta["name"]
+            box_item_meta[file_id] = (meta["size"], meta["sha1"])
         return dic
     except Exception as e:
         print(e)
         return None
 
 """
-Download all zip file
-@param box_files, dictionary key = item.id.astype(int), value = item.name.astype(str)
-@param save_dir, directory to save zip file
+Read logs of instances low..high, downloading only the archives that hold them.
+@param box_items, dictionary key = item.id.astype(int), value = item.name.astype(str)
+@param low, first instance id
+@param high, last instance id
+@param save_dir, directory zips are downloaded to
+@return dictionary key = instance id, value = parsed log
 """
-def downloadZip(box_files:list, save_dir:str):
-    # if save directory not exist, create one
-    if not os.path.exists(save_dir):
-        os.system(f"mkdir {save_dir}")
-    
-    # get all file ids
-    keys = [*box_files]
-    for i in tqdm(range(len(keys))):
-        # extract file_id and file_name
-        file_id = int(keys[i])
-        file_name = box_files[file_id]
-        # if file not exists, download from box
-        if not os.path.exists(f"{save_dir}/{file_name}"):
-            output_file = open(f"{save_dir}/{file_name}", 'wb')
-            client.file(file_id).download_to(output_file)
+def fetchInstanceLogs(box_items:dict, low:int, high:int, save_dir:str)->dict:
+    os.makedirs(save_dir, exist_ok = True)
+    logs = {}
+    for start, end, file_id, name in ArchiveIntervalIndex(box_items).overlapping(low, high):
+        error = fetchZip(file_id, f"{save_dir}/{name}")
+        if error is not None:
+            raise error
+        with zipfile.ZipFile(f"{save_dir}/{name}") as zf:
+            for info in zf.infolist():
+                instance_id = int(os.path.basename(info.filename).replace("assessment_instance_", "").split("_")[0])
+                if low <= instance_id <= high:
+                    with zf.open(info) as f:
+                        logs[instance_id] = json.load(f)
+    return logs
+
+"""
+File writer that hashes everything written through it.
+"""
+class HashingWriter:
+    def __init__(self, f, sha1):
+        self.f = f
+        self.sha1 = sha1
+
+    def write(self, data):
+        self.sha1.update(data)
+        return self.f.write(data)
+
+def fileSha1(path:str, sha1 = None):
+    sha1 = sha1 if sha1 is not None else hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(8 * 1024 * 1024), b""):
+            sha1.update(chunk)
+    return sha1
+
+"""
+Check a local zip against box size and sha1. A verified (size, mtime, sha1) is kept in {path}.sha1,
+so later runs do not read big zips again just to hash them.
+@return True if local file is complete
+"""
+def isVerified(path:str, size, sha1)->bool:
+    if not os.path.exists(path):
+        return False
+    stat = os.stat(path)
+    if size is not None and stat.st_size != size:
+        return False
+    if not sha1:
+        return True
+    try:
+        with open(f"{path}.sha1") as f:
+            cached = json.load(f)
+        if cached == [stat.st_size, stat.st_mtime, sha1]:
+            return True
+    except (OSError, ValueError):
+        pass
+    if fileSha1(path).hexdigest() != sha1:
+        return False
+    with open(f"{path}.sha1", "w") as f:
+        json.dump([stat.st_size, stat.st_mtime, sha1], f)
+    return True
+
+"""
+Download a single zip to {path}.part and rename once size and sha1 match box.
+An interrupted .part is continued with a ranged download instead of starting over.
+@return None if file is ready, otherwise the error
+"""
+def fetchZip(file_id:int, path:str, attempts:int = 3):
+    size, sha1 = box_item_meta.get(file_id, (None, None))
+    if size is None:
+        item = client.file(file_id).get(fields=["size", "sha1"])
+        size, sha1 = item.size, item.sha1
+    if isVerified(path, size, sha1):
+        return None
+    error = None
+    for attempt in range(attempts):
+        try:
+            have = os.path.getsize(f"{path}.part") if os.path.exists(f"{path}.part") else 0
+            if size is not None and have > size:
+                have = 0
+            # hash what is already there, the rest is hashed while it streams in
+            digest = fileSha1(f"{path}.part") if have > 0 else hashlib.sha1()
+            with open(f"{path}.part", "ab" if have > 0 else "wb") as f:
+                if size is None or have < size:
+                    client.file(file_id).download_to(HashingWriter(f, digest), byte_range = (have,) if have > 0 else None)
+            got = os.path.getsize(f"{path}.part")
+            if (size is not None and got != size) or (sha1 and digest.hexdigest() != sha1):
+                os.remove(f"{path}.part")
+                raise IOError(f"{os.path.basename(path)} does not match box, got {got} bytes sha1 {digest.hexdigest()}")
+            os.replace(f"{path}.part", path)
+            if sha1:
+                stat = os.stat(path)
+                with open(f"{path}.sha1", "w") as f:
+                    json.dump([stat.st_size, stat.st_mtime, sha1], f)
+            return None
+        except Exception as e:
+            error = e
+    return error
+
+"""
+Process pool forked from a fork server instead of from this process. Downloads and csv parsing
+run in threads while pools start, and forking a process that has running threads can deadlock the child.
+The server imports this script once, so workers start without importing pandas again.
+@param workers, number of processes, 0 for one per core
+"""
+def processPool(workers:int, **kwargs)->ProcessPoolExecutor:
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["__main__"])
+    return ProcessPoolExecutor(max_workers = workers if workers > 0 else None, mp_context = context, **kwargs)
 
 
+"""
+read first submission_id of each group from a single all_submissions csv
+@param path, path to csv file
+@return dataframe, submission_id int64, Usernames, in order groups first appear
+"""
+def readSubmissionCsv(path:str)->pd.DataFrame:
+    # only the two columns used, first row of each group in a single pass
+    df = pd.read_csv(path, usecols = ['submission_id', 'Usernames'], engine = CSV_ENGINE)
+    df = df.dropna(subset = ['Usernames']).drop_duplicates(subset = 'Usernames', keep = 'first')
+    df['submission_id'] = pd.to_numeric(df['submission_id'], errors = 'coerce')
+    return df.dropna(subset = ['submission_id']).astype({'submission_id': np.int64})
+
 """
 extract single submission_id from each group in all files in directory
 @param all_submission_dir, path to directory of all_submissions csv files
-@return dictionary, key = submission_id.astype(str) value = (f"csv_file_name@Usernames", -1)
+@return dataframe, one row per submission: submission_id int64, file_name and Username categorical,
+        assessment_instance_id int64 = -1 until matched
 """
-def extractSubmissions(all_submission_dir:str)->dict:
-    submission_dic = {}
+def extractSubmissions(all_submission_dir:str)->pd.DataFrame:
+    frames = []
+    paths = []
     # for all files in directory
     for root, dirs, files in os.walk(all_submission_dir, topdown=False):
-        for i in tqdm(range(len(files))):
-            name = files[i]
-            # read in dataframe
-            df = pd.read_csv(os.path.join(root, name))
-            # extract groups
-            groups = df['Usernames'].unique()
-            # for each group, extract groupdf, add one submission to dict
-            for group in groups:
-                group_df = df[df['Usernames'] == group]
-                submission_dic[str(group_df['submission_id'].values[0])] = (f'{name}@{group}', -1)
-    return submission_dic
+        for name in files:
+            paths.append((root, name))
+    # files are parsed in parallel, merged in directory order so later files still win
+    with processPool(csv_workers) as pool:
+        results = pool.map(readSubmissionCsv, [os.path.join(root, name) for root, name in paths])
+        # runs alongside the zip stage, so its progress bar sits below the zip one
+        for (root, name), df in tqdm(zip(paths, results), total = len(paths), desc = "csvs", position = 1):
+            frames.append(pd.DataFrame({'submission_id': df['submission_id'].to_numpy(),
+                                        'file_name': pd.Categorical([name] * len(df)),
+                                        'Username': df['Usernames'].astype(str).to_numpy()}))
+    if len(frames) == 0:
+        return pd.DataFrame({'submission_id': np.empty(0, dtype = np.int64), 'file_name': pd.Categorical([]),
+                             'Username': pd.Categorical([]), 'assessment_instance_id': np.empty(0, dtype = np.int64)})
+    submissions = pd.concat(frames, ignore_index = True)
+    submissions = submissions.drop_duplicates(subset = 'submission_id', keep = 'last').reset_index(drop = True)
+    submissions['file_name'] = submissions['file_name'].astype('category')
+    submissions['Username'] = submissions['Username'].astype('category')
+    submissions['assessment_instance_id'] = np.full(len(submissions), -1, dtype = np.int64)
+    return submissions
 
 """
-Extract all submissions from all assessment_instance_log files
+Download zips and extract submissions from all assessment_instance_log files as a dataflow:
+each zip is handed to an extract worker as soon as its download finishes, while other zips still download.
 @param data_dir, path to where zip file stored
 @param filtered_items, filter items from filterBoxItem function
-@return result_list, each element is a json with key = assessment_instance_id, value = submissions list
+@return InstanceSubmissions of every indexed instance
 """
-def extractInstanceSubmissions(data_dir:str, filtered_items:dict)->list:
-    result_list = []; existed_id = set()
-    # if there's saved file, load in first
+def extractInstanceSubmissions(data_dir:str, filtered_items:dict)->InstanceSubmissions:
+    index = InstanceMatchIndex(match_index_path)
+    # a json from a run before the index existed is imported once
     try:
-        if load_instance_match_dir != "" and os.path.exists(load_instance_match_dir):
-            result_list = json.load(open(load_instance_match_dir))
-            for d in result_list:
-                existed_id.add(str(d['assessment_instance_id']))
+        if load_instance_match_dir != "" and os.path.exists(load_instance_match_dir) and index.isEmpty():
+            with open(load_instance_match_dir) as f:
+                index.importRows([(d['assessment_instance_id'], d['submissions']) for d in json.load(f)])
     except Exception as e:
         print(f"Load {load_instance_match_dir} failed. {e}")
-    
-    unzip_dir = "" # temp unzip dorectory
-    filtered_names = set(filtered_items.values())
+
+    os.makedirs(data_dir, exist_ok = True)
+    downloads = None; extracts = None
     try:
-        # load data
-        for root, dirs, files in os.walk(data_dir, topdown=False):
-            for i in tqdm(range(len(files))):
-                file_name = files[i]
-                if file_name not in filtered_names:
-                    continue
-                # create temporary directory
-                unzip_dir = str(uuid.uuid4())
-                os.system(f"mkdir {data_dir}/{unzip_dir}")
-                # unzip file to temp dir
-                os.system(f"unzip -qq {data_dir}/{file_name} -d {data_dir}/{unzip_dir}")
-                # iterate through every json file
-                for unzip_root, unzip_dirs, unzip_files in os.walk(f'{data_dir}/{unzip_dir}'):
-                    for filename in unzip_files:
-                        if ".json" in filename:
-                            # load json, extract instance_id
-                            instance_id = str(filename.replace("assessment_instance_","").split("_")[0])
-                            # if already written, skip
-                            if instance_id in existed_id:
-                                continue
-                            data = json.load(open(f'{data_dir}/{unzip_dir}/{filename}'))
-                            # extract all submission_id in current json file
-                            submissions = []
-                            for d in data:
-                                if d['submission_id'] == None:
-                                    continue
-                                submissions.append(d['submission_id'])
-                            # create json key = assessment_instance_id, value = submissions list
-                            cur_json = {'assessment_instance_id': instance_id, 'submissions' : submissions}
-                            # append to result_json
-                            result_list.append(cur_json)
-                # delete temp dir
-                os.system(f"rm -rf {data_dir}/{unzip_dir}")
-        # save result
-        with open(save_instance_match_dir, "w") as f:
-            json.dump(result_list, f)
-        return result_list
+        # archives processed before at their current box size are neither downloaded nor opened
+        done = index.doneArchives()
+        archives = sorted((archiveStart(name), int(file_id), name) for file_id, name in filtered_items.items()
+                          if done.get(name) is None or done[name] != box_item_meta.get(int(file_id), (None, None))[0])
+        # instances of an archive being redone are extracted again, addArchive replaces its old rows
+        existed_id = index.instanceIds(except_archives = [name for _, _, name in archives])
+        workers = extract_workers if extract_workers > 0 else os.cpu_count()
+        downloads = ThreadPoolExecutor(max_workers = download_workers)
+        if workers == 1:
+            # a single extract thread still overlaps with downloads
+            initExtractWorker(existed_id)
+            extracts = ThreadPoolExecutor(max_workers = 1)
+        else:
+            # each worker gets existed_id once, archives are handed out one at a time
+            extracts = processPool(workers, initializer = initExtractWorker, initargs = (existed_id,))
+        pending = {downloads.submit(fetchZip, file_id, f"{data_dir}/{name}"): ("download", order, name)
+                   for order, (_, file_id, name) in enumerate(archives)}
+        # archives are added to the index in instance id order whatever order they finish in,
+        # an archive is marked done together with its rows, an interrupted run loses at most the archives in flight
+        ready = {}; next_order = 0
+        with tqdm(total = len(archives), desc = "zips", position = 0) as bar:
+            while pending:
+                finished, _ = wait(pending, return_when = FIRST_COMPLETED)
+                for future in finished:
+                    stage, order, name = pending.pop(future)
+                    path = f"{data_dir}/{name}"
+                    if stage == "download":
+                        error = future.result()
+                        if error is not None:
+                            print(f"{bcolors.FAIL} download {name} failed: {error} {bcolors.ENDC}")
+                        # a copy left from an earlier run is still used if the download failed
+                        if not os.path.exists(path) or done.get(name) == os.path.getsize(path):
+                            ready[order] = None
+                        else:
+                            pending[extracts.submit(extractArchive, path)] = ("extract", order, name)
+                    else:
+                        ready[order] = (name, os.path.getsize(path), future.result())
+                while next_order in ready:
+                    archive = ready.pop(next_order); next_order += 1
+                    if archive is not None:
+                        index.addArchive(*archive)
+                    bar.update()
+        instance_submissions = index.load()
+        # json export only if asked for, the index is what reruns read
+        if save_instance_match_dir != "":
+            with JsonWriter(save_instance_match_dir) as writer:
+                batch = []
+                for instance_id, submissions in instance_submissions.rows():
+                    batch.append({'assessment_instance_id': str(instance_id), 'submissions': submissions})
+                    if len(batch) == result_batch_rows:
+                        writer.writeRows(batch); batch = []
+                writer.writeRows(batch)
+        return instance_submissions
     except (KeyboardInterrupt, Exception) as e:
-        if os.path.exists(f"{data_dir}/{unzip_dir}"):
-            os.system(f"rm -rf {data_dir}/{unzip_dir}")
         print(e)
         return None
+    finally:
+        for pool in (downloads, extracts):
+            if pool is not None:
+                pool.shutdown(cancel_futures = True)
+        index.close()
+
+"""
+@param file_name, {start}_{end}.zip
+@return start instance id, -1 if name does not follow the pattern
+"""
+def archiveStart(file_name:str)->int:
+    try:
+        return int(file_name.split("_")[0])
+    except ValueError:
+        return -1
+
+def initExtractWorker(existed_id:set):
+    global worker_existed_id
+    worker_existed_id = existed_id
+
+"""
+Extract submissions of one zip in a worker process
+@param zip_path, path to zip file
+@return InstanceSubmissions of the zip, compact to send back to parent
+"""
+def extractArchive(zip_path:str)->InstanceSubmissions:
+    return readArchiveSubmissions(zip_path, worker_existed_id)
 
 """
-Find assessment_instance that contains submission_id (key of submission_dic), and update submission_dic
-@param submission_dic, key = submission_id.astype(str) value = (f"csv_file_name@Usernames", -1)
-@param instance_submission_list, list containing json, key = assessment_instance_id, value = submissions list
-@return updated submission_dic
+Extract submissions of every assessment_instance_log in a zip, read in memory without unzipping to disk
+@param zip_path, path to zip file
+@param existed_id, assessment_instance_id.astype(int) already extracted, skipped before decompressing
+@return InstanceSubmissions of the zip
 """
-def matchInstanceId(submission_dic:dict, instance_submission_list:list)->dict:
-    # for each json, key = assessment_instance_id, value = submissions_id
-    for i in tqdm(range(len(instance_submission_list))):
-        cur_data = instance_submission_list[i]
-        instance_id = cur_data['assessment_instance_id']
-        submissions = cur_data['submissions']
-        # for all submissions
-        for submission in submissions:
-            submission = str(submission)
-            # if find a match in submission_dic, update assessment_instance_id to submission_dic
-            if submission in submission_dic:
-                submission_dic[submission] = (submission_dic[submission][0], instance_id)
-                break
-    # return updated submission_dic
-    return submission_dic
+def readArchiveSubmissions(zip_path:str, existed_id:set)->InstanceSubmissions:
+    instance_ids = []; offsets = [0]; values = []
+    with zipfile.ZipFile(zip_path) as zf:
+        for info in zf.infolist():
+            filename = os.path.basename(info.filename)
+            if ".json" not in filename:
+                continue
+            # extract instance_id from member name, if already written, skip
+            instance_id = int(filename.replace("assessment_instance_","").split("_")[0])
+            if instance_id in existed_id:
+                continue
+            # only submission_id of every event is kept, large logs are streamed
+            with zf.open(info) as f:
+                values += [s for s in iterSubmissionIds(f, info.file_size) if s is not None]
+            instance_ids.append(instance_id)
+            offsets.append(len(values))
+    return InstanceSubmissions(instance_ids, offsets, values)
+
+"""
+Find assessment_instance that contains each submission_id, and fill it into submissions.
+Every (instance, submission) pair goes into flat int64 arrays sorted by submission, and each csv
+submission is looked up with searchsorted, so every submission of an instance can match, not just the first.
+A submission found in several instances gets the smallest instance id and is reported.
+@param submissions, dataframe from extractSubmissions
+@param instance_submissions, InstanceSubmissions from extractInstanceSubmissions
+@return submissions with assessment_instance_id filled in, -1 if not found
+"""
+def matchInstanceId(submissions:pd.DataFrame, instance_submissions:InstanceSubmissions)->pd.DataFrame:
+    pair_instance, pair_submission = instance_submissions.pairs()
+    # sort by submission then instance, drop repeated pairs
+    order = np.lexsort((pair_instance, pair_submission))
+    pair_submission = pair_submission[order]; pair_instance = pair_instance[order]
+    keep = np.ones(len(order), dtype = bool)
+    keep[1:] = (np.diff(pair_submission) != 0) | (np.diff(pair_instance) != 0)
+    pair_submission = pair_submission[keep]; pair_instance = pair_instance[keep]
+
+    wanted = submissions['submission_id'].to_numpy(dtype = np.int64)
+    left = np.searchsorted(pair_submission, wanted, side = 'left')
+    counts = np.searchsorted(pair_submission, wanted, side = 'right') - left
+    matched = counts > 0
+    instance_ids = np.full(len(wanted), -1, dtype = np.int64)
+    instance_ids[matched] = pair_instance[left[matched]]
+    submissions['assessment_instance_id'] = instance_ids
+    multiple = int((counts > 1).sum())
+    print(f"matched {int(matched.sum())} of {len(wanted)} submissions, {len(wanted) - int(matched.sum())} unmatched, {multiple} in more than one instance")
+    if multiple > 0:
+        print(f"{bcolors.WARNING} submissions in more than one instance, smallest instance id used: {wanted[counts > 1][:20].tolist()} {bcolors.ENDC}")
+    return submissions
 
 """
-filter zip files with starting instance_id < threshold
+keep zip files holding any instance in threshold..ending, other box items are dropped
 @param threshold, starting threshold
 @param box_items, dictionary key = item.id.astype(int), value = item.name.astype(str)
+@param ending, last instance id, 0 for no limit
 @return updated_box_items, dictionary key = item.id.astype(int), value = item.name.astype(str)
 """
-def filterBoxItem(threshold:int, box_items:dict)->dict:
-    to_remove = []
-    # find all zip that has starting instance < threshold
-    for key in box_items:
-        cur_start_index = int(box_items[key].split("_")[0])
-        if cur_start_index < threshold:
-            to_remove.append(key)
-    # delete 
-    for key in to_remove:
-        del box_items[key]
-    return box_items
+def filterBoxItem(threshold:int, box_items:dict, ending:int = 0)->dict:
+    keep = ArchiveIntervalIndex(box_items).overlapping(threshold, ending if ending > 0 else float("inf"))
+    return {file_id: name for _, _, file_id, name in keep}
 
 
 def main():
@@ -204,33 +421,26 @@ def main():
     print(f"{bcolors.OKGREEN}\u2713 {bcolors.ENDC}")
     # filter items
     print("Step 2 / 7: Filtering required zips...", end = "",flush=True)
-    filtered_items = filterBoxItem(threshold = starting_instance_id,box_items =  box_items)
+    filtered_items = filterBoxItem(threshold = starting_instance_id,box_items =  box_items, ending = ending_instance_id)
     print(f"{bcolors.OKGREEN}\u2713 {bcolors.ENDC}")
-    # if local does not have zip, load them
-    print("Step 3 / 7: Downloading missing zip files...",flush=True)
-    downloadZip(box_files = filtered_items, save_dir = data_dir)
-    print("Step 4 / 7: Extracting submissions from csvs...",flush=True)
-    # extract submissions from all_submission_csv
-    submission_dic = extractSubmissions(all_submission_dir = all_submission_dir)
-    # extract instance-submissions pair match
-    print("Step 5 / 7: Creating instance - submission dictionary...",flush=True)
-    match_list = extractInstanceSubmissions(data_dir = data_dir, filtered_items = filtered_items)
+    # csvs and zips share nothing until matching, csvs are parsed in the background meanwhile
+    with ThreadPoolExecutor(max_workers = 1) as background:
+        print("Step 3 / 7: Extracting submissions from csvs in background...",flush=True)
+        csv_future = background.submit(extractSubmissions, all_submission_dir = all_submission_dir)
+        # extract instance-submissions pair match, each zip as soon as it is downloaded
+        print("Step 4 / 7: Downloading zips and creating instance - submission dictionary...",flush=True)
+        instance_submissions = extractInstanceSubmissions(data_dir = data_dir, filtered_items = filtered_items)
+        print("Step 5 / 7: Waiting for csvs...",flush=True)
+        submissions = csv_future.result()
     # match assessment_instance_id to each submissions
     print("Step 6 / 7: Matching submission - instance...",flush=True)
-    updated_submission_dic =  matchInstanceId(submission_dic = submission_dic,
-                                              instance_submission_list = match_list)
+    submissions = matchInstanceId(submissions = submissions, instance_submissions = instance_submissions)
     print("Step 7 / 7: Saving results...")
-    # save results
-    with open(result_dir, "w") as f:
-        result = []
-        for submission in updated_submission_dic:
-            cur_data = updated_submission_dic[submission]
-            pos = cur_data[0].find("@")
-            cur_dic = {"file_name": cur_data[0][:pos], 
-                       "Username": cur_data[0][pos + 1:],
-                       "assessment_instance_id": cur_data[1]}
-            result.append(cur_dic)
-        json.dump(result, f)
+    # save results, a batch of rows at a time
+    with ResultWriter(result_dir, result_format, shard_by_file) as writer:
+        for start in tqdm(range(0, len(submissions), result_batch_rows)):
+            # slice rows first, selecting columns of the whole frame would copy it every batch
+            writer.write(submissions.iloc[start:start + result_batch_rows][RESULT_COLUMNS])
 
     print(f"{bcolors.OKGREEN}successful \u2713 {bcolors.ENDC}")
 
@@ -247,7 +457,21 @@ if __name__ == "__main__":
     save_instance_match_dir = args.save_instance_match_dir
     load_instance_match_dir = args.load_instance_match_dir
     starting_instance_id = args.starting_instance_id
+    csv_workers = args.csv_workers
+    download_workers = args.download_workers
+    ending_instance_id = args.ending_instance_id
+    box_listing_cache = args.box_listing_cache
+    box_listing_max_age = args.box_listing_max_age
+    box_listing_full_refresh = args.box_listing_full_refresh
+    extract_workers = args.extract_workers
+    match_index_path = args.match_index_path
+    result_format = args.result_format
+    shard_by_file = args.shard_by_file
+    result_batch_rows = args.result_batch_rows
     # sanity check
+    if result_format == "parquet" and CSV_ENGINE != "pyarrow":
+        print(f"{bcolors.FAIL}parquet results need pyarrow installed{bcolors.ENDC}")
+        exit()
     if os.path.exists(result_dir):
         print("\n\033[93mWARNING. Output directory already has file. Override [y] / N ?\033[0m")
         confirm = input()
@@ -3,6 +3,11 @@ python match.py --box_config_path [replace this]\
                 --data_dir [replace this]\
                 --all_submission_dir [replace this]\
                 --[optional] result_dir [replace this].json\
+                --[optional] result_format json\
+                --[optional] shard_by_file\
+                --[optional] match_index_path [replace this].sqlite\
                 --[optional] save_instance_match_dir [replace this].json\
                 --[optional] load_instance_match_dir [replace this].json\
-                --[optional] starting_instance_id 1
\ No newline at end of file
+                --[optional] starting_instance_id 1\
+                --[optional] ending_instance_id 0\
+                --[optional] box_listing_cache [replace this].json
\ No newline at end of file
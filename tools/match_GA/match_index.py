@@ -0,0 +1,152 @@
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+"""
+Ragged int64 arrays of submissions per assessment instance.
+Submissions of instance_ids[i] are values[offsets[i]:offsets[i + 1]].
+"""
+class InstanceSubmissions:
+    def __init__(self, instance_ids, offsets, values):
+        self.instance_ids = np.asarray(instance_ids, dtype = np.int64)
+        self.offsets = np.asarray(offsets, dtype = np.int64)
+        self.values = np.asarray(values, dtype = np.int64)
+
+    """
+    @param rows, iterable of (instance_id, submissions list)
+    """
+    @classmethod
+    def fromRows(cls, rows):
+        instance_ids = []; offsets = [0]; values = []
+        for instance_id, submissions in rows:
+            instance_ids.append(int(instance_id))
+            values += [int(s) for s in submissions]
+            offsets.append(len(values))
+        return cls(instance_ids, offsets, values)
+
+    def __len__(self):
+        return len(self.instance_ids)
+
+    """
+    @return (instance id of every pair, submission id of every pair), flat int64 arrays
+    """
+    def pairs(self):
+        return np.repeat(self.instance_ids, np.diff(self.offsets)), self.values
+
+    """
+    @return iterator of (instance_id, submissions list)
+    """
+    def rows(self):
+        values = self.values.tolist(); offsets = self.offsets.tolist()
+        for i, instance_id in enumerate(self.instance_ids.tolist()):
+            yield instance_id, values[offsets[i]:offsets[i + 1]]
+
+
+"""
+Persistent instance -> submission index built from box log zips.
+Every fully processed {start}_{end}.zip is recorded with its size, in the same
+transaction as its rows, so a rerun skips whole archives without opening them
+and only appends what is new. An archive whose size changed on box is redone.
+"""
+class InstanceMatchIndex:
+    """
+    @param path, sqlite database file
+    """
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread = False)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS archive (
+                name TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                processed_at REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS instance (
+                instance_id INTEGER PRIMARY KEY,
+                archive TEXT);
+            CREATE TABLE IF NOT EXISTS instance_submission (
+                instance_id INTEGER NOT NULL,
+                submission_id INTEGER NOT NULL,
+                PRIMARY KEY (instance_id, submission_id)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS instance_archive ON instance (archive);""")
+        self.conn.commit()
+
+    """
+    @return dictionary key = archive name, value = size when it was processed
+    """
+    def doneArchives(self):
+        with self.lock:
+            return dict(self.conn.execute("SELECT name, size FROM archive"))
+
+    """
+    @param except_archives, archive names whose instances are left out, e.g. archives about to be redone
+    @return set of indexed instance ids
+    """
+    def instanceIds(self, except_archives = ()):
+        except_archives = set(except_archives)
+        with self.lock:
+            return {r[0] for r in self.conn.execute("SELECT instance_id, archive FROM instance") if r[1] not in except_archives}
+
+    def isEmpty(self):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM instance LIMIT 1").fetchone() is None
+
+    """
+    Record a fully processed archive with its rows, replacing rows of an older copy of it.
+    @param name, archive file name
+    @param size, archive size in bytes
+    @param rows, InstanceSubmissions of the archive
+    """
+    def addArchive(self, name, size, rows):
+        with self.lock:
+            with self.conn:
+                old = [r[0] for r in self.conn.execute("SELECT instance_id FROM instance WHERE archive = ?", (name,))]
+                self.conn.executemany("DELETE FROM instance_submission WHERE instance_id = ?", [(i,) for i in old])
+                self.conn.execute("DELETE FROM instance WHERE archive = ?", (name,))
+                self.insert(rows, name)
+                self.conn.execute("INSERT OR REPLACE INTO archive VALUES (?, ?, ?)", (name, size, time.time()))
+
+    """
+    Import rows that are not tied to an archive, e.g. an instance_submission_match.json from an older run.
+    @param rows, list of (instance_id, submissions list)
+    """
+    def importRows(self, rows):
+        with self.lock:
+            with self.conn:
+                self.insert(InstanceSubmissions.fromRows(rows), None)
+
+    def insert(self, rows, archive):
+        pair_instance, pair_submission = rows.pairs()
+        self.conn.executemany("INSERT OR REPLACE INTO instance VALUES (?, ?)", ((i, archive) for i in rows.instance_ids.tolist()))
+        self.conn.executemany("INSERT OR IGNORE INTO instance_submission VALUES (?, ?)", zip(pair_instance.tolist(), pair_submission.tolist()))
+
+    """
+    Read a query of integer columns into int64 arrays without holding every row as python tuples.
+    """
+    def readColumns(self, query, columns, chunk = 100000):
+        parts = []
+        cursor = self.conn.execute(query)
+        while True:
+            batch = cursor.fetchmany(chunk)
+            if not batch:
+                break
+            parts.append(np.array(batch, dtype = np.int64).reshape(-1, columns))
+        return np.concatenate(parts) if parts else np.empty((0, columns), dtype = np.int64)
+
+    """
+    @return InstanceSubmissions of every indexed instance, by instance id, submissions ascending
+    """
+    def load(self):
+        with self.lock:
+            instance_ids = self.readColumns("SELECT instance_id FROM instance ORDER BY instance_id", 1)[:, 0]
+            pairs = self.readColumns("SELECT instance_id, submission_id FROM instance_submission ORDER BY instance_id, submission_id", 2)
+        offsets = np.searchsorted(pairs[:, 0], instance_ids, side = 'left')
+        return InstanceSubmissions(instance_ids, np.append(offsets, len(pairs)), pairs[:, 1])
+
+    def close(self):
+        with self.lock:
+            self.conn.commit()
+            self.conn.close()
@@ -0,0 +1,161 @@
+import json
+import os
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+"""
+Streaming writers of match results. Rows are written batch by batch as they are produced,
+so the result is never held as a list of dicts, and jsonl and csv files can be read while the run goes on.
+"""
+
+FORMATS = {"json": ".json", "jsonl": ".jsonl", "csv": ".csv", "parquet": ".parquet"}
+RESULT_COLUMNS = ["file_name", "Username", "assessment_instance_id"]
+
+
+"""
+@param frame, dataframe with RESULT_COLUMNS, assessment_instance_id int64
+@return list of result json rows, matched ids as strings and unmatched as -1
+"""
+def resultRows(frame)->list:
+    return [{"file_name": file_name, "Username": username, "assessment_instance_id": str(instance_id) if instance_id >= 0 else -1}
+            for file_name, username, instance_id in zip(frame['file_name'].astype(str), frame['Username'].astype(str),
+                                                        frame['assessment_instance_id'].tolist())]
+
+
+"""
+json array, or one json object per line if lines.
+The array comes out byte for byte as json.dump of the whole list would write it.
+"""
+class JsonWriter:
+    def __init__(self, path:str, lines:bool = False):
+        self.f = open(path, "w")
+        self.lines = lines
+        self.empty = True
+        if not lines:
+            self.f.write("[")
+
+    """
+    @param rows, list of dictionaries
+    """
+    def writeRows(self, rows:list):
+        if len(rows) == 0:
+            return
+        if self.lines:
+            self.f.write("".join(json.dumps(row) + "\n" for row in rows))
+        else:
+            # one dump per batch, brackets dropped, batches joined like items
+            self.f.write(("" if self.empty else ", ") + json.dumps(rows)[1:-1])
+        self.empty = False
+        self.f.flush()
+
+    def write(self, frame):
+        self.writeRows(resultRows(frame))
+
+    def close(self):
+        if not self.lines:
+            self.f.write("]")
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+"""
+csv with a header row, assessment_instance_id int64, -1 if not matched
+"""
+class CsvWriter:
+    def __init__(self, path:str):
+        self.f = open(path, "w", newline = "")
+        self.header = True
+
+    def write(self, frame):
+        frame.to_csv(self.f, columns = RESULT_COLUMNS, header = self.header, index = False)
+        self.header = False
+        self.f.flush()
+
+    def close(self):
+        if self.header:
+            self.f.write(",".join(RESULT_COLUMNS) + "\n")
+        self.f.close()
+
+
+"""
+parquet, one row group per batch, assessment_instance_id int64, -1 if not matched
+"""
+class ParquetWriter:
+    SCHEMA = None if pq is None else pyarrow.schema([("file_name", pyarrow.string()), ("Username", pyarrow.string()),
+                                                     ("assessment_instance_id", pyarrow.int64())])
+
+    def __init__(self, path:str):
+        self.writer = pq.ParquetWriter(path, self.SCHEMA)
+
+    def write(self, frame):
+        frame = frame[RESULT_COLUMNS].astype({"file_name": str, "Username": str})
+        self.writer.write_table(pyarrow.Table.from_pandas(frame, schema = self.SCHEMA, preserve_index = False))
+
+    def close(self):
+        self.writer.close()
+
+
+"""
+Result writer of one format, into a single file, or if shard_by_file, into {path}/{csv file name}{extension},
+one file per all_submissions csv the rows come from.
+"""
+class ResultWriter:
+    """
+    @param path, result file, or directory of shards
+    @param result_format, key of FORMATS
+    @param shard_by_file, one file per source csv
+    """
+    def __init__(self, path:str, result_format:str = "json", shard_by_file:bool = False):
+        if result_format not in FORMATS:
+            raise ValueError(f"unknown result format {result_format}")
+        if result_format == "parquet" and pq is None:
+            raise ImportError("parquet results need pyarrow")
+        self.path = path
+        self.result_format = result_format
+        self.shard_by_file = shard_by_file
+        self.writers = {}
+        if shard_by_file:
+            os.makedirs(path, exist_ok = True)
+        else:
+            self.writers[None] = self.open(path)
+
+    def open(self, path:str):
+        if self.result_format == "csv":
+            return CsvWriter(path)
+        if self.result_format == "parquet":
+            return ParquetWriter(path)
+        return JsonWriter(path, lines = self.result_format == "jsonl")
+
+    def shard(self, file_name:str):
+        if file_name not in self.writers:
+            self.writers[file_name] = self.open(os.path.join(self.path, os.path.splitext(file_name)[0] + FORMATS[self.result_format]))
+        return self.writers[file_name]
+
+    """
+    @param frame, batch of rows with RESULT_COLUMNS
+    """
+    def write(self, frame):
+        if not self.shard_by_file:
+            self.writers[None].write(frame)
+            return
+        for file_name, part in frame.groupby('file_name', observed = True, sort = False):
+            self.shard(str(file_name)).write(part)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()